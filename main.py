@@ -5,13 +5,19 @@ import time
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Callable, Iterator, Sequence
 import threading
 import queue
 import base64
+import csv
+import itertools
+from contextlib import closing
+import hashlib
 from io import BytesIO
+from collections import OrderedDict
 
 # Для работы с Excel
+import numpy as np
 import pandas as pd
 import openpyxl
 
@@ -30,6 +36,23 @@ from tkinter import ttk, filedialog, messagebox, scrolledtext
 # Для работы с изображениями
 from PIL import Image, ImageGrab
 
+# Для сопоставления шаблонов (необязательно)
+try:
+    import cv2
+
+    HAS_CV2 = True
+except ImportError:
+    HAS_CV2 = False
+
+# Для пакетного ввода через XTest (необязательно, только Linux/X11)
+try:
+    from Xlib import X, XK, display as xdisplay
+    from Xlib.ext import xtest
+
+    HAS_XLIB = True
+except ImportError:
+    HAS_XLIB = False
+
 pyautogui.FAILSAFE = True
 
 
@@ -44,6 +67,34 @@ class Config:
         self.use_image_recognition = True
         self.verify_input = True  # Проверять введенные данные
         self.max_attempts = 3     # Максимальное количество попыток
+        self.search_margin = 40   # Запас окна поиска вокруг последнего положения поля, px (0 - весь экран)
+        self.matcher_backend = "opencv"  # Сопоставление шаблонов: "opencv" или "numpy"
+        self.use_pyramid = False  # Грубый поиск в 1/4 масштаба с уточнением лучших кандидатов
+        self.pyramid_candidates = 3
+        self.adaptive_timing = False  # Ждать реакции экрана вместо фиксированных пауз
+        self.learn_timing = False     # Подбирать паузы каждого поля по измеренным задержкам
+        self.pacing_mode = "fixed"    # Старт и переход между строками: "fixed" (паузы) или "event" (по условиям)
+        self.row_done_condition = "region_changed"  # "region_changed", "field_cleared" или "result_panel"
+        self.start_timeout = 10.0     # Сколько ждать появления формы перед стартом, с
+        self.row_done_timeout = 5.0   # Сколько ждать условия завершения строки, с
+        self.fill_mode = "mouse"      # "mouse" - клик в каждое поле, "tab" - переход между полями клавишей Tab
+        self.input_method = "auto"    # "auto" - выбор по значению и статистике, "type" или "paste"
+        self.input_backend = "pyautogui"  # "pyautogui" или "xtest" (события поля отправляются одним пакетом)
+        self.pyautogui_pause = 0.1    # Неявная пауза pyautogui после каждого вызова, с
+        self.differential_fill = False  # Не перезаполнять поля, значение которых не изменилось с прошлой строки
+        self.verify_mode = "field"    # "field" - проверка после каждого поля, "row" - один снимок после всей строки
+        self.stream_excel = False     # Читать Excel построчно во время заполнения, не загружая файл целиком
+        self.excel_cache_dir = ".excel_cache"  # Кэш разобранных таблиц ("" - не кэшировать)
+        self.csv_encoding = ""        # Кодировка CSV/TSV ("" - UTF-8, а если файл не в UTF-8 - cp1251)
+        # Столбец таблицы (номер с 0 или заголовок из первой строки) -> поле формы, преобразования по порядку:
+        # "trim", "upper", "lower", "translit", "date_split" (в три поля "fields": день, месяц, год)
+        self.column_mapping = [
+            {"column": 1, "field": FieldType.LAST_NAME},
+            {"column": 2, "field": FieldType.FIRST_NAME},
+            {"column": 3, "field": FieldType.MIDDLE_NAME},
+            {"column": 4, "fields": [FieldType.BIRTH_DAY, FieldType.BIRTH_MONTH, FieldType.BIRTH_YEAR],
+             "transforms": ["date_split"]},
+        ]
 
     def save(self, filename: str = "config.json"):
         with open(filename, 'w', encoding='utf-8') as f:
@@ -68,18 +119,89 @@ class FieldType:
     BIRTH_DAY = "Дата рождения (день)"
     BIRTH_MONTH = "Дата рождения (месяц)"
     BIRTH_YEAR = "Дата рождения (год)"
+    ANCHOR = "Якорь"
+    RESULT_PANEL = "Панель результата"
+
+
+class TemplateLevel:
+    """Уменьшенная копия шаблона для грубого поиска"""
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+        self.height, self.width = array.shape
+        self.spectra: Dict[Tuple[int, int], np.ndarray] = {}
+
+
+class FieldTemplate:
+    """Декодированный шаблон поля: изображение в оттенках серого и его массив"""
+    PYRAMID_FACTOR = 4
+    MIN_LEVEL_SIZE = 8
+
+    def __init__(self, image_data: str):
+        img_bytes = base64.b64decode(image_data)
+        self.image = Image.open(BytesIO(img_bytes)).convert('L')
+        self.array = np.asarray(self.image, dtype=np.float32)
+        self.width, self.height = self.image.size
+        self.spectra: Dict[Tuple[int, int], np.ndarray] = {}  # Спектры шаблона по размеру БПФ
+
+        # Уровень пирамиды строится при загрузке вместе с шаблоном
+        self.coarse: Optional[TemplateLevel] = None
+        if min(self.width, self.height) // self.PYRAMID_FACTOR >= self.MIN_LEVEL_SIZE:
+            self.coarse = TemplateLevel(self.downsample(self.array, self.PYRAMID_FACTOR))
+
+    @staticmethod
+    def downsample(array: np.ndarray, factor: int) -> np.ndarray:
+        """Уменьшение в factor раз усреднением блоков"""
+        h, w = array.shape[0] // factor, array.shape[1] // factor
+        blocks = array[:h * factor, :w * factor].reshape(h, factor, w, factor)
+        return blocks.mean(axis=(1, 3)).astype(np.float32)
 
 
 class FormField:
     def __init__(self, name: str, field_type: str, screen_position: Tuple[int, int],
                  size: Tuple[int, int] = (300, 50), image_data: Optional[str] = None,
-                 click_offset: Tuple[int, int] = (10, 10)):
+                 click_offset: Tuple[int, int] = (10, 10), anchor_offset: Optional[Tuple[int, int]] = None):
         self.name = name
         self.field_type = field_type
         self.screen_position = screen_position
         self.size = size
         self.image_data = image_data
         self.click_offset = click_offset
+        self.anchor_offset = anchor_offset  # Смещение относительно первого якоря формы
+        self.timings = StepTimings()  # Измеренные задержки приложения по шагам заполнения
+        self.blank_sample: Optional[np.ndarray] = None  # Вид очищенного поля, снятый во время работы
+        self.last_value: Optional[str] = None  # Последнее успешно введённое значение
+        self.last_region: Optional[Tuple[int, int, int, int]] = None  # Область, в которую вводили последний раз
+        self._template: Optional[FieldTemplate] = None
+        self.last_location: Optional[Tuple[int, int]] = None  # Где шаблон найден в прошлый раз
+
+    def get_template(self) -> Optional[FieldTemplate]:
+        """Шаблон декодируется один раз и переиспользуется до перезагрузки полей"""
+        if self._template is None and self.image_data:
+            self._template = FieldTemplate(self.image_data)
+        return self._template
+
+    def reset_template(self):
+        self._template = None
+        self.last_location = None
+
+    def current_region(self) -> Tuple[int, int, int, int]:
+        """Область поля с учётом последнего найденного положения шаблона"""
+        w, h = self.size
+        template = self.get_template()
+        if self.last_location and template is not None:
+            x = self.last_location[0] + template.width // 2 - w // 2
+            y = self.last_location[1] + template.height // 2 - h // 2
+        else:
+            x, y = self.screen_position
+        return (x, y, x + w, y + h)
+
+    def expected_location(self) -> Tuple[int, int]:
+        """Ожидаемый левый верхний угол шаблона по записанным координатам"""
+        template = self.get_template()
+        x, y = self.screen_position
+        w, h = self.size
+        return (x + w // 2 - template.width // 2, y + h // 2 - template.height // 2)
 
     def get_click_position(self) -> Tuple[int, int]:
         x, y = self.screen_position
@@ -94,7 +216,8 @@ class FormField:
             'screen_position': self.screen_position,
             'size': self.size,
             'image_data': self.image_data,
-            'click_offset': self.click_offset
+            'click_offset': self.click_offset,
+            'anchor_offset': self.anchor_offset
         }
 
     @classmethod
@@ -105,29 +228,130 @@ class FormField:
             screen_position=tuple(data['screen_position']),
             size=tuple(data['size']),
             image_data=data.get('image_data'),
-            click_offset=tuple(data.get('click_offset', (10, 10)))
+            click_offset=tuple(data.get('click_offset', (10, 10))),
+            anchor_offset=tuple(data['anchor_offset']) if data.get('anchor_offset') else None
         )
 
 
+class InputMethodSelector:
+    """Выбор способа ввода значения: набор с клавиатуры или вставка из буфера обмена"""
+    TYPE = "type"
+    PASTE = "paste"
+    LONG_VALUE = 8              # Более длинные значения выгоднее вставлять
+    MIN_SAMPLES = 5
+    MIN_SUCCESS_RATE = 0.9
+
+    def __init__(self, mode: str = "auto"):
+        self.mode = mode
+        self.stats = {method: {'calls': 0, 'seconds': 0.0, 'chars': 0, 'verified': 0, 'failed': 0}
+                      for method in (self.TYPE, self.PASTE)}
+
+    def success_rate(self, method: str) -> Optional[float]:
+        stats = self.stats[method]
+        checked = stats['verified'] + stats['failed']
+        return stats['verified'] / checked if checked >= self.MIN_SAMPLES else None
+
+    def estimate(self, method: str, value: str) -> Optional[float]:
+        """Ожидаемое время ввода значения по накопленной статистике"""
+        stats = self.stats[method]
+        if stats['calls'] < self.MIN_SAMPLES:
+            return None
+        if method == self.TYPE:
+            return stats['seconds'] / max(stats['chars'], 1) * len(value)
+        return stats['seconds'] / stats['calls']
+
+    def choose(self, value: str) -> str:
+        if self.mode in (self.TYPE, self.PASTE):
+            return self.mode
+
+        # pyautogui.write не умеет набирать кириллицу
+        if not value.isascii():
+            return self.PASTE
+
+        candidates = []
+        for method in (self.TYPE, self.PASTE):
+            rate = self.success_rate(method)
+            if rate is None or rate >= self.MIN_SUCCESS_RATE:
+                candidates.append(method)
+        if not candidates:
+            candidates = [self.TYPE, self.PASTE]
+
+        estimates = {method: self.estimate(method, value) for method in candidates}
+        if all(estimate is not None for estimate in estimates.values()):
+            return min(estimates, key=estimates.get)
+
+        default = self.TYPE if len(value) <= self.LONG_VALUE else self.PASTE
+        return default if default in candidates else candidates[0]
+
+    @staticmethod
+    def paste_with_clipboard(text: str, speed_factor: float = 1.0, backend: Optional['InputBackend'] = None):
+        """Вставить текст используя буфер обмена"""
+        backend = backend or InputBackend.default
+        pyperclip.copy(text)
+        backend.hotkey('ctrl', 'v')
+        if not backend.batched:
+            time.sleep(0.05 * speed_factor)  # Дать время для вставки
+
+    def enter(self, value: str, speed_factor: float = 1.0, backend: Optional['InputBackend'] = None) -> str:
+        """Ввести значение выбранным способом; возвращает использованный способ"""
+        backend = backend or InputBackend.default
+        method = self.choose(value)
+        if method == self.TYPE and not backend.can_type(value):
+            method = self.PASTE
+
+        started = time.perf_counter()
+        if method == self.PASTE:
+            self.paste_with_clipboard(value, speed_factor, backend)
+        else:
+            backend.write(value, interval=0.02 * speed_factor)
+
+        # Пакетный ввод здесь только ставит события в очередь, время ввода не измерить
+        if backend.batched:
+            return method
+
+        stats = self.stats[method]
+        stats['calls'] += 1
+        stats['seconds'] += time.perf_counter() - started
+        stats['chars'] += len(value)
+        return method
+
+    def record_result(self, method: str, verified: bool):
+        self.stats[method]['verified' if verified else 'failed'] += 1
+
+    def report(self) -> str:
+        parts = []
+        for method, stats in self.stats.items():
+            if stats['calls']:
+                rate = self.success_rate(method)
+                rate_text = f", проверено {rate:.0%}" if rate is not None else ""
+                parts.append(f"{method}: {stats['calls']} раз, {stats['seconds'] / stats['calls'] * 1000:.0f} мс"
+                             f"{rate_text}")
+        return "; ".join(parts)
+
+
 class FormAction:
-    def __init__(self, field: FormField, value: str, delay_before: float = 0.3, delay_after: float = 0.3):
+    def __init__(self, field: FormField, value: str, delay_before: float = 0.3, delay_after: float = 0.3,
+                 location: Optional['MatchResult'] = None):
         self.field = field
         self.value = str(value) if value is not None else ""
         self.delay_before = delay_before
         self.delay_after = delay_after
+        self.location = location  # Положение, найденное общим поиском по строке
 
-    def verify_field_content(self, expected_value: str, region: Tuple[int, int, int, int]) -> bool:
+    def verify_field_content(self, expected_value: str, region: Tuple[int, int, int, int],
+                             waiter: Optional['ScreenWaiter'] = None) -> bool:
         """Проверка содержимого поля через буфер обмена"""
+        pause = (lambda delay: waiter.wait(delay, step='verify')) if waiter else time.sleep
         try:
             # Фокус в поле
             pyautogui.moveTo(region[0] + 10, region[1] + 10)
             pyautogui.click()
-            time.sleep(0.15)
+            pause(0.15)
 
             pyautogui.hotkey('ctrl', 'a')
-            time.sleep(0.15)
+            pause(0.15)
             pyautogui.hotkey('ctrl', 'c')
-            time.sleep(0.2)
+            pause(0.2)
 
             actual_value = pyperclip.paste().strip()
 
@@ -141,80 +365,140 @@ class FormAction:
             logging.warning(f"Ошибка при проверке поля: {e}")
             return False
 
+    def click_position(self, use_image: bool = False, search_margin: int = 40,
+                       use_cached: bool = True) -> Tuple[int, int]:
+        """Координаты клика: найденное положение шаблона или записанные координаты"""
+        template = self.field.get_template() if use_image else None
+        match = None
+        if use_image and use_cached and self.location is not None:
+            match = self.location
+        elif template is not None:
+            match = ImageLocator.locate_field(self.field, search_margin)
+
+        if match:
+            center_x, center_y = match.center()
+            logging.debug(f"Поле '{self.field.name}' найдено с уверенностью {match.confidence:.2f} "
+                          f"(порог {match.threshold})")
+            return (center_x + self.field.click_offset[0], center_y + self.field.click_offset[1])
+
+        if template is not None:
+            logging.warning(f"Изображение не найдено для поля {self.field.name}, использую координаты")
+        return self.field.get_click_position()
+
     def execute(self, speed_factor: float = 1.0, use_image: bool = False,
-                verify: bool = False, max_attempts: int = 3) -> bool:
-        """Заполнение одного поля"""
+                verify: bool = False, max_attempts: int = 3, search_margin: int = 40,
+                adaptive: bool = False, learn: bool = False,
+                input_selector: Optional[InputMethodSelector] = None,
+                backend: Optional['InputBackend'] = None,
+                on_typed: Optional[Callable[[], None]] = None) -> bool:
+        """Заполнение одного поля; on_typed вызывается сразу после ввода значения"""
+        backend = backend or InputBackend.default
         for attempt in range(max_attempts):
             try:
-                time.sleep(self.delay_before * speed_factor)
+                if not adaptive:
+                    time.sleep(self.delay_before * speed_factor)
 
                 # Определяем координаты клика
-                if use_image and self.field.image_data:
-                    img_bytes = base64.b64decode(self.field.image_data)
-                    img = Image.open(BytesIO(img_bytes))
-
-                    for confidence in [0.9, 0.8, 0.7]:
-                        location = pyautogui.locateOnScreen(img, confidence=confidence, grayscale=True)
-                        if location:
-                            center_x, center_y = pyautogui.center(location)
-                            click_x = center_x + self.field.click_offset[0]
-                            click_y = center_y + self.field.click_offset[1]
-                            break
+                click_x, click_y = self.click_position(use_image, search_margin, use_cached=attempt == 0)
+
+                # Область поля вокруг найденной точки клика
+                field_w, field_h = self.field.size
+                field_x = click_x - self.field.click_offset[0] - field_w // 2
+                field_y = click_y - self.field.click_offset[1] - field_h // 2
+                region = (field_x, field_y, field_x + field_w, field_y + field_h)
+                self.field.last_region = region
+
+                waiter = ScreenWaiter(region, speed_factor, adaptive, self.field.timings if learn else None)
+                if adaptive:
+                    waiter.wait(self.delay_before)
+
+                if backend.batched:
+                    # Все события поля уходят одним пакетом, паузы между ними не нужны
+                    before = waiter.snapshot('type')
+                    backend.move(click_x, click_y)
+                    backend.click()
+                    backend.hotkey('ctrl', 'a')
+                    backend.press('backspace')
+                    if input_selector is not None:
+                        method = input_selector.enter(self.value, speed_factor, backend)
                     else:
-                        logging.warning(f"Изображение не найдено для поля {self.field.name}, использую координаты")
-                        click_x, click_y = self.field.get_click_position()
+                        method = InputMethodSelector.TYPE
+                        backend.write(self.value)
+                    backend.flush()
+                    if on_typed is not None:
+                        on_typed()
+                    waiter.wait(0.25, before, 'type')
                 else:
-                    click_x, click_y = self.field.get_click_position()
-
-                # Гарантированный фокус в поле
-                pyautogui.moveTo(click_x, click_y, duration=0.3 * speed_factor)
-                time.sleep(0.2 * speed_factor)
-                pyautogui.click()
-                time.sleep(0.1 * speed_factor)
-
-                # Выделить и удалить старый текст
-                pyautogui.hotkey('ctrl', 'a')
-                time.sleep(0.15 * speed_factor)
-                pyautogui.press('backspace')
-                time.sleep(0.25 * speed_factor)
-
-                # Дополнительная проверка, что поле пустое
-                pyautogui.hotkey('ctrl', 'a')
-                time.sleep(0.15 * speed_factor)
-                pyautogui.hotkey('ctrl', 'c')
-                time.sleep(0.2 * speed_factor)
-                clipboard_content = pyperclip.paste()
-
-                if clipboard_content.strip():
-                    pyautogui.press('backspace', presses=3, interval=0.05 * speed_factor)
-                    time.sleep(0.2 * speed_factor)
-                    pyautogui.hotkey('ctrl', 'a')
-                    time.sleep(0.15 * speed_factor)
-                    pyautogui.press('backspace')
-                    time.sleep(0.25 * speed_factor)
-
-                # Ввод нового значения напрямую через write
-                pyautogui.write(self.value, interval=0.02 * speed_factor)  # основной фикс
-                time.sleep(0.25 * speed_factor)
+                    # Гарантированный фокус в поле
+                    backend.move(click_x, click_y, duration=0.3 * speed_factor)
+                    waiter.wait(0.2, step='focus')
+                    before = waiter.snapshot('focus')
+                    backend.click()
+                    waiter.wait(0.1, before, 'focus')
+
+                    # Выделить и удалить старый текст
+                    before = waiter.snapshot('clear')
+                    backend.hotkey('ctrl', 'a')
+                    waiter.wait(0.15, before, 'clear')
+                    before = waiter.snapshot('clear')
+                    backend.press('backspace')
+                    waiter.wait(0.25, before, 'clear')
+
+                    # Дополнительная проверка, что поле пустое
+                    before = waiter.snapshot('clear')
+                    backend.hotkey('ctrl', 'a')
+                    waiter.wait(0.15, before, 'clear')
+                    backend.hotkey('ctrl', 'c')
+                    waiter.wait(0.2, step='clear')
+                    clipboard_content = pyperclip.paste()
+
+                    if clipboard_content.strip():
+                        before = waiter.snapshot('clear')
+                        backend.press('backspace', presses=3, interval=0.05 * speed_factor)
+                        waiter.wait(0.2, before, 'clear')
+                        before = waiter.snapshot('clear')
+                        backend.hotkey('ctrl', 'a')
+                        waiter.wait(0.15, before, 'clear')
+                        before = waiter.snapshot('clear')
+                        backend.press('backspace')
+                        waiter.wait(0.25, before, 'clear')
+
+                    # Вид пустого поля нужен для условия завершения строки "field_cleared"
+                    if self.field.blank_sample is None:
+                        self.field.blank_sample = ReadinessCondition.grab_gray(region)
+
+                    # Ввод нового значения: набор или вставка в зависимости от значения
+                    before = waiter.snapshot('type')
+                    if input_selector is not None:
+                        method = input_selector.enter(self.value, speed_factor, backend)
+                    else:
+                        method = InputMethodSelector.TYPE
+                        backend.write(self.value, interval=0.02 * speed_factor)  # основной фикс
+                    if on_typed is not None:
+                        on_typed()
+                    waiter.wait(0.25, before, 'type')
 
                 if verify:
-                    field_x, field_y = self.field.screen_position
-                    field_w, field_h = self.field.size
-                    region = (field_x, field_y, field_x + field_w, field_y + field_h)
+                    waiter.wait(0.3, step='verify')
 
-                    time.sleep(0.3 * speed_factor)
+                    verified = self.verify_field_content(self.value, region, waiter if adaptive or learn else None)
+                    if input_selector is not None:
+                        input_selector.record_result(method, verified)
 
-                    if self.verify_field_content(self.value, region):
+                    if verified:
                         logging.info(f"✓ Поле '{self.field.name}' успешно заполнено значением '{self.value}'")
-                        time.sleep(self.delay_after * speed_factor)
+                        waiter.commit()
+                        waiter.wait(self.delay_after)
                         return True
                     else:
+                        waiter.fail()
                         logging.warning(f"Попытка {attempt + 1}/{max_attempts} не удалась для поля '{self.field.name}'")
                         if attempt < max_attempts - 1:
                             time.sleep(0.5)
                             continue
                 else:
-                    time.sleep(self.delay_after * speed_factor)
+                    waiter.commit()
+                    waiter.wait(self.delay_after)
                     return True
 
             except Exception as e:
@@ -227,32 +511,794 @@ class FormAction:
         return False
 
 
+# ================== ОЖИДАНИЯ ==================
+class StepTimings:
+    """Задержки приложения по шагам заполнения одного поля"""
+    STEPS = ('focus', 'clear', 'type', 'verify')
+    MAX_SAMPLES = 50
+    MIN_SAMPLES = 5
+    PERCENTILE = 90
+    MARGIN = 1.2          # Запас поверх высокого перцентиля
+    MIN_DELAY = 0.02
+    BACKOFF_STEP = 1.5    # Во сколько раз замедляться после неудачной проверки
+    MAX_BACKOFF = 4.0
+
+    def __init__(self, samples: Optional[Dict[str, List[float]]] = None, backoff: float = 1.0):
+        self.samples = {step: list((samples or {}).get(step, [])) for step in self.STEPS}
+        self.backoff = backoff
+
+    def ready(self, step: str) -> bool:
+        return len(self.samples.get(step, [])) >= self.MIN_SAMPLES
+
+    def delay(self, step: str) -> float:
+        observed = float(np.percentile(self.samples[step], self.PERCENTILE))
+        return max(observed * self.MARGIN, self.MIN_DELAY) * self.backoff
+
+    def record(self, step: str, seconds: float):
+        values = self.samples.setdefault(step, [])
+        values.append(round(seconds, 4))
+        del values[:-self.MAX_SAMPLES]
+
+    def success(self):
+        self.backoff = max(1.0, self.backoff / self.BACKOFF_STEP)
+
+    def failure(self):
+        self.backoff = min(self.MAX_BACKOFF, self.backoff * self.BACKOFF_STEP)
+
+    def to_dict(self):
+        return {'samples': self.samples, 'backoff': self.backoff}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(samples=data.get('samples'), backoff=data.get('backoff', 1.0))
+
+
+class ReadinessCondition:
+    """Условие готовности экрана, проверяемое опросом до таймаута"""
+    POLL_INTERVAL = 0.05
+    BLANK_TOLERANCE = 8.0  # Допустимое среднее отличие от пустого поля (курсор, рамка фокуса)
+    CHANGE_TOLERANCE = 0.5  # Среднее отличие области формы, с которого она считается изменившейся
+
+    def __init__(self, description: str, check: Callable[[], bool]):
+        self.description = description
+        self.check = check
+
+    def wait(self, timeout: float, should_continue: Callable[[], bool] = lambda: True) -> bool:
+        deadline = time.perf_counter() + timeout
+        while should_continue():
+            try:
+                if self.check():
+                    return True
+            except Exception as e:
+                logging.debug(f"Ошибка проверки условия '{self.description}': {e}")
+            if time.perf_counter() >= deadline:
+                break
+            time.sleep(self.POLL_INTERVAL)
+        return False
+
+    @staticmethod
+    def grab_gray(region: Tuple[int, int, int, int]) -> np.ndarray:
+        return np.asarray(ImageGrab.grab(bbox=region).convert('L'), dtype=np.float32)
+
+    @classmethod
+    def template_visible(cls, item: 'FormField') -> 'ReadinessCondition':
+        return cls(f"виден шаблон '{item.name}'",
+                   lambda: ImageLocator.locate_field(item, margin=0) is not None)
+
+    @classmethod
+    def region_changed(cls, region: Tuple[int, int, int, int], reference: Optional[np.ndarray] = None,
+                       exclude: Optional[Tuple[int, int, int, int]] = None) -> 'ReadinessCondition':
+        """Область изменилась относительно reference (по умолчанию - текущего вида).
+        Участок exclude - поле с фокусом, где мигает курсор, - не сравнивается"""
+        before = reference if reference is not None else cls.grab_gray(region)
+        mask = np.ones(before.shape, dtype=bool)
+        if exclude is not None:
+            left, top = max(exclude[0] - region[0], 0), max(exclude[1] - region[1], 0)
+            right, bottom = max(exclude[2] - region[0], 0), max(exclude[3] - region[1], 0)
+            mask[top:bottom, left:right] = False
+        if not mask.any():
+            mask[:] = True
+
+        def check() -> bool:
+            current = cls.grab_gray(region)
+            if current.shape != before.shape:
+                return False
+            return float(np.abs(current - before)[mask].mean()) > cls.CHANGE_TOLERANCE
+        return cls("изменилась область формы", check)
+
+    @classmethod
+    def field_cleared(cls, field: 'FormField') -> 'ReadinessCondition':
+        def check() -> bool:
+            current = cls.grab_gray(field.current_region())
+            if current.shape != field.blank_sample.shape:
+                return False
+            return float(np.abs(current - field.blank_sample).mean()) <= cls.BLANK_TOLERANCE
+        return cls(f"очищено поле '{field.name}'", check)
+
+
+class ScreenWaiter:
+    """Паузы шагов заполнения: фиксированные, по событию на экране или выученные"""
+    POLL_INTERVAL = 0.01
+    STABLE_FOR = 0.05       # Сколько пиксели области должны не меняться
+    TIMEOUT_FACTOR = 4.0    # Предельное ожидание относительно фиксированной паузы
+    MIN_TIMEOUT = 0.5
+
+    def __init__(self, region: Tuple[int, int, int, int], speed_factor: float = 1.0, adaptive: bool = False,
+                 timings: Optional[StepTimings] = None):
+        self.region = region
+        self.speed_factor = speed_factor
+        self.adaptive = adaptive
+        self.timings = timings
+        self.pending: List[Tuple[str, float]] = []  # Замеры, ещё не подтверждённые проверкой
+
+    @staticmethod
+    def region_hash(region: Tuple[int, int, int, int]) -> bytes:
+        """Быстрый отпечаток пикселей области"""
+        image = ImageGrab.grab(bbox=region)
+        return hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+
+    def observing(self, step: Optional[str]) -> bool:
+        """Нужно ли следить за экраном: адаптивный режим или шаг, для которого ещё мало замеров"""
+        if self.timings is not None and step is not None:
+            return not self.timings.ready(step)
+        return self.adaptive
+
+    def snapshot(self, step: Optional[str] = None) -> Optional[bytes]:
+        """Состояние области до действия (только когда за экраном следим)"""
+        return self.region_hash(self.region) if self.observing(step) else None
+
+    def wait(self, delay: float, before: Optional[bytes] = None, step: Optional[str] = None) -> bool:
+        """Пауза delay * speed_factor, выученная пауза шага или ожидание реакции области поля"""
+        if self.timings is not None and step is not None and self.timings.ready(step):
+            time.sleep(self.timings.delay(step))
+            return True
+
+        fixed = delay * self.speed_factor
+        if not self.observing(step):
+            time.sleep(fixed)
+            return True
+
+        timeout = max(fixed * self.TIMEOUT_FACTOR, self.MIN_TIMEOUT)
+        elapsed = self.settle(before, change_timeout=fixed, timeout=timeout)
+        if self.timings is not None and step is not None:
+            self.pending.append((step, timeout if elapsed is None else elapsed))
+        return elapsed is not None
+
+    def commit(self):
+        """Поле прошло проверку: замеры становятся частью статистики"""
+        if self.timings is None:
+            return
+        for step, seconds in self.pending:
+            self.timings.record(step, seconds)
+        self.pending = []
+        self.timings.success()
+
+    def fail(self):
+        """Поле не прошло проверку: замеры отбрасываются, паузы увеличиваются"""
+        if self.timings is None:
+            return
+        self.pending = []
+        self.timings.failure()
+
+    def settle(self, before: Optional[bytes], change_timeout: float, timeout: float) -> Optional[float]:
+        """Дождаться изменения области относительно before, затем её неподвижности.
+        Возвращает время до последнего изменения или None по таймауту"""
+        started = time.perf_counter()
+        deadline = started + timeout
+        current = self.region_hash(self.region)
+
+        # Изменения может не быть (например, пустое поле снова очищено), поэтому ждём не дольше прежней паузы
+        if before is not None:
+            while current == before and time.perf_counter() - started < change_timeout:
+                time.sleep(self.POLL_INTERVAL)
+                current = self.region_hash(self.region)
+
+        stable_since = time.perf_counter()
+        while time.perf_counter() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            latest = self.region_hash(self.region)
+            if latest != current:
+                current = latest
+                stable_since = time.perf_counter()
+            elif time.perf_counter() - stable_since >= self.STABLE_FOR:
+                return stable_since - started
+
+        logging.debug(f"Область {self.region} не успокоилась за {timeout:.2f} с")
+        return None
+
+
+# ================== ПРОВЕРКА СТРОКИ ==================
+class RowVerifier:
+    """Проверка всех полей строки по снимку формы вместо буфера обмена для каждого поля"""
+    TOLERANCE = 8.0         # Допустимое среднее отличие пикселей (курсор, рамка фокуса)
+    MAX_RENDERINGS = 512    # Сколько известных изображений значений хранить на поле
+
+    def __init__(self):
+        self.renderings: Dict[str, OrderedDict] = {}  # Поле -> значение -> вид поля с этим значением
+        self.box: Optional[Tuple[int, int, int, int]] = None
+        self.before: Optional[np.ndarray] = None
+        self.after: Optional[np.ndarray] = None
+
+    @staticmethod
+    def field_region(field: FormField) -> Tuple[int, int, int, int]:
+        return field.last_region or field.current_region()
+
+    @staticmethod
+    def similar(a: np.ndarray, b: Optional[np.ndarray]) -> bool:
+        return b is not None and a.shape == b.shape and float(np.abs(a - b).mean()) <= RowVerifier.TOLERANCE
+
+    def crop(self, image: np.ndarray, region: Tuple[int, int, int, int]) -> np.ndarray:
+        x1, y1 = region[0] - self.box[0], region[1] - self.box[1]
+        return image[max(0, y1):max(0, region[3] - self.box[1]), max(0, x1):max(0, region[2] - self.box[0])]
+
+    def begin(self, fields: List[FormField]):
+        """Снимок формы до заполнения строки"""
+        regions = [self.field_region(field) for field in fields]
+        self.box = (min(r[0] for r in regions), min(r[1] for r in regions),
+                    max(r[2] for r in regions), max(r[3] for r in regions))
+        self.before = ReadinessCondition.grab_gray(self.box)
+
+    def check(self, filled: List[Tuple[FormField, str, Optional[str]]]) -> Tuple[List[FormField], List[FormField]]:
+        """Один снимок формы после заполнения. Возвращает несовпавшие поля и поля,
+        вид которых с этим значением ещё неизвестен"""
+        self.after = ReadinessCondition.grab_gray(self.box)
+        mismatched, unknown = [], []
+
+        for field, value, previous in filled:
+            region = self.field_region(field)
+            patch = self.crop(self.after, region)
+            known = self.renderings.get(field.name, {}).get(value)
+
+            if known is not None:
+                if not self.similar(patch, known):
+                    mismatched.append(field)
+            elif self.similar(patch, field.blank_sample):
+                mismatched.append(field)  # Поле осталось пустым
+            elif previous is not None and previous != value and self.similar(patch, self.crop(self.before, region)):
+                mismatched.append(field)  # Поле не изменилось, хотя значение другое
+            else:
+                unknown.append(field)
+
+        return mismatched, unknown
+
+    def remember(self, field: FormField, value: str):
+        """Запомнить вид поля с подтверждённым значением из последнего снимка"""
+        values = self.renderings.setdefault(field.name, OrderedDict())
+        values[value] = self.crop(self.after, self.field_region(field)).copy()
+        values.move_to_end(value)
+        while len(values) > self.MAX_RENDERINGS:
+            values.popitem(last=False)
+
+
+# ================== ВВОД ==================
+class InputBackend:
+    """Переносимый ввод через pyautogui; считает неявные паузы pyautogui.PAUSE"""
+    name = "pyautogui"
+    batched = False
+    default: 'InputBackend'
+
+    def __init__(self):
+        self.implicit_calls = 0
+
+    @property
+    def implicit_pause(self) -> float:
+        """Сколько секунд добавили неявные паузы pyautogui"""
+        return self.implicit_calls * pyautogui.PAUSE
+
+    def move(self, x: int, y: int, duration: float = 0.0):
+        pyautogui.moveTo(x, y, duration=duration)
+        self.implicit_calls += 1
+
+    def click(self):
+        pyautogui.click()
+        self.implicit_calls += 1
+
+    def hotkey(self, *keys: str):
+        pyautogui.hotkey(*keys)
+        self.implicit_calls += 1
+
+    def press(self, key: str, presses: int = 1, interval: float = 0.0):
+        pyautogui.press(key, presses=presses, interval=interval)
+        self.implicit_calls += 1
+
+    def write(self, text: str, interval: float = 0.0):
+        pyautogui.write(text, interval=interval)
+        self.implicit_calls += 1
+
+    def can_type(self, text: str) -> bool:
+        return text.isascii()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def create(name: str) -> 'InputBackend':
+        if name == XTestBackend.name:
+            if HAS_XLIB:
+                try:
+                    return XTestBackend()
+                except Exception as e:
+                    logging.warning(f"Не удалось подключиться к X-серверу: {e}, использую pyautogui")
+            else:
+                logging.warning("Модуль python-xlib не установлен, использую pyautogui: pip install python-xlib")
+        return InputBackend()
+
+
+InputBackend.default = InputBackend()
+
+
+class XTestBackend(InputBackend):
+    """Ввод через расширение XTest: события поля копятся и отправляются одним пакетом"""
+    name = "xtest"
+    batched = True
+    KEY_NAMES = {
+        'ctrl': 'Control_L', 'shift': 'Shift_L', 'alt': 'Alt_L',
+        'backspace': 'BackSpace', 'delete': 'Delete', 'tab': 'Tab', 'enter': 'Return', 'esc': 'Escape',
+        ' ': 'space', '\t': 'Tab', '\n': 'Return',
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.display = xdisplay.Display()
+        self.events: List[Tuple[int, int, int, int]] = []  # (тип, код, x, y)
+
+    def keysym(self, key: str) -> int:
+        name = self.KEY_NAMES.get(key, key)
+        keysym = XK.string_to_keysym(name)
+        if keysym == 0 and len(key) == 1:
+            # Латиница-1 совпадает с кодом символа, остальное - Unicode keysym
+            keysym = ord(key) if ord(key) < 0x100 else 0x01000000 + ord(key)
+        return keysym
+
+    def keycode(self, key: str) -> Tuple[int, bool]:
+        """Код клавиши и нужен ли Shift"""
+        keysym = self.keysym(key)
+        code = self.display.keysym_to_keycode(keysym)
+        if code == 0:
+            raise ValueError(f"Нет клавиши для '{key}' в текущей раскладке")
+        return code, self.display.keycode_to_keysym(code, 0) != keysym
+
+    def key_events(self, key: str):
+        code, shifted = self.keycode(key)
+        if shifted:
+            self.events.append((X.KeyPress, self.keycode('shift')[0], 0, 0))
+        self.events.append((X.KeyPress, code, 0, 0))
+        self.events.append((X.KeyRelease, code, 0, 0))
+        if shifted:
+            self.events.append((X.KeyRelease, self.keycode('shift')[0], 0, 0))
+
+    def move(self, x: int, y: int, duration: float = 0.0):
+        self.events.append((X.MotionNotify, 0, x, y))
+
+    def click(self):
+        self.events.append((X.ButtonPress, 1, 0, 0))
+        self.events.append((X.ButtonRelease, 1, 0, 0))
+
+    def hotkey(self, *keys: str):
+        codes = [self.keycode(key)[0] for key in keys]
+        self.events.extend((X.KeyPress, code, 0, 0) for code in codes)
+        self.events.extend((X.KeyRelease, code, 0, 0) for code in reversed(codes))
+
+    def press(self, key: str, presses: int = 1, interval: float = 0.0):
+        for _ in range(presses):
+            self.key_events(key)
+
+    def write(self, text: str, interval: float = 0.0):
+        for char in text:
+            self.key_events(char)
+
+    def can_type(self, text: str) -> bool:
+        try:
+            for char in set(text):
+                self.keycode(char)
+            return True
+        except ValueError:
+            return False
+
+    def flush(self):
+        """Отправить накопленные события и дождаться их приёма X-сервером"""
+        # XTest обходит pyautogui, поэтому аварийную остановку проверяем сами
+        pyautogui.failSafeCheck()
+        events, self.events = self.events, []
+        for event_type, detail, x, y in events:
+            if event_type == X.MotionNotify:
+                xtest.fake_input(self.display, event_type, x=x, y=y)
+            else:
+                xtest.fake_input(self.display, event_type, detail)
+        self.display.sync()
+
+    def close(self):
+        """Закрыть соединение с X-сервером"""
+        self.events = []
+        self.display.close()
+
+
+# ================== ПОИСК ИЗОБРАЖЕНИЙ ==================
+class MatchResult:
+    def __init__(self, left: int, top: int, width: int, height: int, confidence: float, threshold: float):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.confidence = confidence  # Достигнутая оценка совпадения
+        self.threshold = threshold    # Самый строгий пройденный порог
+
+    def center(self) -> Tuple[int, int]:
+        return (self.left + self.width // 2, self.top + self.height // 2)
+
+
+class OpenCVMatcher:
+    name = "opencv"
+
+    def score_map(self, haystack: np.ndarray, template: FieldTemplate) -> np.ndarray:
+        return cv2.matchTemplate(haystack, template.array, cv2.TM_CCOEFF_NORMED)
+
+
+class NumpyFFTMatcher:
+    """Нормированная взаимная корреляция через БПФ NumPy, без OpenCV"""
+    name = "numpy"
+    MAX_SPECTRA = 8
+
+    @staticmethod
+    def fast_len(n: int) -> int:
+        """Ближайший сверху размер, раскладывающийся на 2, 3 и 5"""
+        while True:
+            m = n
+            for p in (2, 3, 5):
+                while m % p == 0:
+                    m //= p
+            if m == 1:
+                return n
+            n += 1
+
+    def template_spectrum(self, template: FieldTemplate, shape: Tuple[int, int]) -> np.ndarray:
+        spectrum = template.spectra.get(shape)
+        if spectrum is None:
+            if len(template.spectra) >= self.MAX_SPECTRA:
+                template.spectra.clear()
+            centered = template.array.astype(np.float64) - template.array.mean()
+            spectrum = np.conj(np.fft.rfft2(centered, s=shape))
+            template.spectra[shape] = spectrum
+        return spectrum
+
+    @staticmethod
+    def window_sums(values: np.ndarray, h: int, w: int) -> np.ndarray:
+        """Суммы по всем окнам h x w через интегральное изображение"""
+        integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+        integral[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+        return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+    def score_map(self, haystack: np.ndarray, template: FieldTemplate) -> np.ndarray:
+        h, w = template.height, template.width
+        image = haystack.astype(np.float64)
+        shape = (self.fast_len(image.shape[0]), self.fast_len(image.shape[1]))
+
+        correlation = np.fft.irfft2(np.fft.rfft2(image, s=shape) * self.template_spectrum(template, shape), s=shape)
+        numerator = correlation[:image.shape[0] - h + 1, :image.shape[1] - w + 1]
+
+        n = h * w
+        sums = self.window_sums(image, h, w)
+        variance = self.window_sums(image * image, h, w) - sums * sums / n
+        template_energy = float(((template.array - template.array.mean()) ** 2).sum())
+
+        denominator = np.sqrt(np.maximum(variance, 0.0) * template_energy)
+        scores = np.zeros_like(numerator)
+        valid = denominator > 1e-6 * max(template_energy, 1.0)
+        scores[valid] = numerator[valid] / denominator[valid]
+        return np.clip(scores, -1.0, 1.0).astype(np.float32)
+
+
+class ImageLocator:
+    CONFIDENCES = (0.9, 0.8, 0.7)
+    MATCHERS = {OpenCVMatcher.name: OpenCVMatcher, NumpyFFTMatcher.name: NumpyFFTMatcher}
+    PYRAMID_MIN_RATIO = 16  # Пирамида имеет смысл, только если снимок намного больше шаблона
+    matcher = OpenCVMatcher() if HAS_CV2 else NumpyFFTMatcher()
+    use_pyramid = False
+    pyramid_candidates = 3
+    level_times: Dict[str, float] = {}  # Суммарное время поиска по уровням пирамиды
+    level_calls: Dict[str, int] = {}
+
+    @classmethod
+    def configure(cls, config: 'Config'):
+        cls.set_backend(config.matcher_backend)
+        cls.use_pyramid = config.use_pyramid
+        cls.pyramid_candidates = max(1, config.pyramid_candidates)
+        cls.level_times = {}
+        cls.level_calls = {}
+
+    @classmethod
+    def record_time(cls, level: str, started: float):
+        cls.level_times[level] = cls.level_times.get(level, 0.0) + time.perf_counter() - started
+        cls.level_calls[level] = cls.level_calls.get(level, 0) + 1
+
+    @classmethod
+    def timing_report(cls) -> str:
+        parts = [f"{level}: {cls.level_times[level] * 1000 / cls.level_calls[level]:.1f} мс x {cls.level_calls[level]}"
+                 for level in cls.level_times]
+        return "; ".join(parts)
+
+    @classmethod
+    def set_backend(cls, name: str):
+        if name == OpenCVMatcher.name and not HAS_CV2:
+            logging.warning("OpenCV недоступен, использую сопоставление NumPy")
+            name = NumpyFFTMatcher.name
+        if name not in cls.MATCHERS:
+            logging.warning(f"Неизвестный способ сопоставления '{name}', использую NumPy")
+            name = NumpyFFTMatcher.name
+        if cls.matcher.name != name:
+            cls.matcher = cls.MATCHERS[name]()
+
+    @staticmethod
+    def grab_screen(region: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+        """Один снимок экрана в оттенках серого"""
+        screenshot = pyautogui.screenshot(region=region)
+        return np.asarray(screenshot.convert('L'), dtype=np.float32)
+
+    @staticmethod
+    def score_map(haystack: np.ndarray, template: FieldTemplate) -> np.ndarray:
+        """Карта оценок совпадения шаблона для каждой позиции снимка"""
+        return ImageLocator.matcher.score_map(haystack, template)
+
+    @staticmethod
+    def locate(template: FieldTemplate, confidences: Tuple[float, ...] = CONFIDENCES,
+               haystack: Optional[np.ndarray] = None,
+               origin: Tuple[int, int] = (0, 0)) -> Optional[MatchResult]:
+        """Поиск шаблона по одному снимку: карта оценок считается один раз для всех порогов"""
+        if haystack is None:
+            haystack = ImageLocator.grab_screen()
+
+        if haystack.shape[0] < template.height or haystack.shape[1] < template.width:
+            return None
+
+        if (ImageLocator.use_pyramid and template.coarse is not None
+                and haystack.size >= ImageLocator.PYRAMID_MIN_RATIO * template.array.size):
+            x, y, best = ImageLocator.locate_pyramid(template, haystack)
+        else:
+            started = time.perf_counter()
+            scores = ImageLocator.score_map(haystack, template)
+            y, x = np.unravel_index(np.argmax(scores), scores.shape)
+            best = float(scores[y, x])
+            ImageLocator.record_time("full", started)
+
+        for threshold in sorted(confidences, reverse=True):
+            if best >= threshold:
+                return MatchResult(int(x) + origin[0], int(y) + origin[1],
+                                   template.width, template.height, best, threshold)
+        return None
+
+    @staticmethod
+    def locate_pyramid(template: FieldTemplate, haystack: np.ndarray) -> Tuple[int, int, float]:
+        """Грубый поиск по уменьшенному снимку и уточнение лучших кандидатов в полном масштабе"""
+        factor = FieldTemplate.PYRAMID_FACTOR
+
+        started = time.perf_counter()
+        coarse_scores = ImageLocator.score_map(FieldTemplate.downsample(haystack, factor), template.coarse)
+        candidates = []
+        for _ in range(ImageLocator.pyramid_candidates):
+            cy, cx = np.unravel_index(np.argmax(coarse_scores), coarse_scores.shape)
+            if coarse_scores[cy, cx] <= -1.0:
+                break
+            candidates.append((int(cx), int(cy)))
+            # Подавление соседей, чтобы кандидаты не совпадали
+            coarse_scores[max(0, cy - 2):cy + 3, max(0, cx - 2):cx + 3] = -1.0
+        ImageLocator.record_time("1/4", started)
+
+        started = time.perf_counter()
+        best_x, best_y, best = 0, 0, -1.0
+        pad = 2 * factor
+        for cx, cy in candidates:
+            x1, y1 = max(0, cx * factor - pad), max(0, cy * factor - pad)
+            x2 = min(haystack.shape[1], cx * factor + template.width + pad)
+            y2 = min(haystack.shape[0], cy * factor + template.height + pad)
+            scores = ImageLocator.score_map(haystack[y1:y2, x1:x2], template)
+            y, x = np.unravel_index(np.argmax(scores), scores.shape)
+            if scores[y, x] > best:
+                best_x, best_y, best = int(x) + x1, int(y) + y1, float(scores[y, x])
+        ImageLocator.record_time("1/1", started)
+
+        logging.debug(f"Пирамида: кандидатов {len(candidates)}, лучшая оценка {best:.2f}")
+        return best_x, best_y, best
+
+    @staticmethod
+    def score_at(haystack: np.ndarray, template: FieldTemplate, left: int, top: int) -> float:
+        """Оценка совпадения шаблона в одной точке снимка"""
+        if left < 0 or top < 0:
+            return 0.0
+        patch = haystack[top:top + template.height, left:left + template.width]
+        if patch.shape != template.array.shape:
+            return 0.0
+
+        a = patch - patch.mean()
+        b = template.array - template.array.mean()
+        denom = np.sqrt(float((a * a).sum()) * float((b * b).sum()))
+        return float((a * b).sum() / denom) if denom > 0 else 0.0
+
+    @staticmethod
+    def search_window(field: FormField, margin: int) -> Tuple[int, int, int, int]:
+        """Окно вокруг последнего найденного (или записанного) положения поля"""
+        template = field.get_template()
+        left, top = field.last_location or field.expected_location()
+        screen_w, screen_h = pyautogui.size()
+
+        x1, y1 = max(0, left - margin), max(0, top - margin)
+        x2 = min(screen_w, left + template.width + margin)
+        y2 = min(screen_h, top + template.height + margin)
+        return (x1, y1, max(0, x2 - x1), max(0, y2 - y1))
+
+    @staticmethod
+    def locate_field(field: FormField, margin: int = 40,
+                     confidences: Tuple[float, ...] = CONFIDENCES) -> Optional[MatchResult]:
+        """Сначала поиск в малом окне, при промахе - по всему экрану"""
+        template = field.get_template()
+        if template is None:
+            return None
+
+        match = None
+        if margin > 0:
+            region = ImageLocator.search_window(field, margin)
+            if region[2] >= template.width and region[3] >= template.height:
+                haystack = ImageLocator.grab_screen(region)
+                match = ImageLocator.locate(template, confidences, haystack, origin=(region[0], region[1]))
+
+        if match is None:
+            match = ImageLocator.locate(template, confidences)
+
+        if match:
+            field.last_location = (match.left, match.top)
+        return match
+
+    @staticmethod
+    def locate_all(fields: List[FormField], margin: int = 40,
+                   confidences: Tuple[float, ...] = CONFIDENCES) -> Dict[FormField, MatchResult]:
+        """Поиск всех полей строки по одному общему снимку экрана"""
+        haystack = ImageLocator.grab_screen()
+        matches = {}
+
+        for field in fields:
+            template = field.get_template()
+            if template is None:
+                continue
+
+            # Шаблон на прежнем месте - экран не менялся, повторный поиск не нужен
+            if field.last_location:
+                left, top = field.last_location
+                score = ImageLocator.score_at(haystack, template, left, top)
+                threshold = next((c for c in sorted(confidences, reverse=True) if score >= c), None)
+                if threshold is not None:
+                    matches[field] = MatchResult(left, top, template.width, template.height, score, threshold)
+                    continue
+
+            match = None
+            if margin > 0:
+                x, y, w, h = ImageLocator.search_window(field, margin)
+                if w >= template.width and h >= template.height:
+                    match = ImageLocator.locate(template, confidences, haystack[y:y + h, x:x + w], origin=(x, y))
+
+            if match is None:
+                match = ImageLocator.locate(template, confidences, haystack)
+
+            if match:
+                field.last_location = (match.left, match.top)
+                matches[field] = match
+            else:
+                logging.warning(f"Изображение не найдено для поля {field.name}")
+
+        return matches
+
+    @staticmethod
+    def locate_layout(anchors: List[FormField], fields: List[FormField], margin: int = 40,
+                      confidences: Tuple[float, ...] = CONFIDENCES) -> Optional[Dict[FormField, MatchResult]]:
+        """Положение всех полей по одному найденному якорю"""
+        for anchor in anchors:
+            match = ImageLocator.locate_field(anchor, margin, confidences)
+            if not match:
+                continue
+
+            # Положение первого якоря: остальные якоря хранят смещение относительно него
+            dx, dy = anchor.anchor_offset or (0, 0)
+            base_x, base_y = match.left - dx, match.top - dy
+
+            layout = {}
+            for field in fields:
+                if field.anchor_offset is None:
+                    continue
+                w, h = field.size
+                layout[field] = MatchResult(base_x + field.anchor_offset[0], base_y + field.anchor_offset[1],
+                                            w, h, match.confidence, match.threshold)
+            return layout
+
+        logging.warning("Якоря формы не найдены на экране")
+        return None
+
+
 # ================== МЕНЕДЖЕР ФОРМ ==================
 class FormManager:
     def __init__(self):
         self.fields: List[FormField] = []
+        self.anchors: List[FormField] = []
+        self.result_panel: Optional[FormField] = None
+        self.tab_order: List[Optional[str]] = []  # Имена полей в порядке Tab, None - пропускаемая остановка
+        self.fields_file: Optional[str] = None
         self.is_recording = False
         self.record_start_time = 0
 
     def start_recording(self, use_image: bool = False):
         self.is_recording = True
         self.fields = []
+        self.anchors = []
+        self.result_panel = None
+        self.tab_order = []
         self.record_start_time = time.time()
         self.use_image = use_image
         logging.info("Запись начата. Используйте горячие клавиши для записи полей.")
 
     def stop_recording(self):
         self.is_recording = False
+        self.bind_to_anchors()
+
+    @staticmethod
+    def capture_image(position: Tuple[int, int], w: int = 200, h: int = 60) -> str:
+        x, y = position
+        screenshot = pyautogui.screenshot(region=(x - w // 2, y - h // 2, w, h))
+        buffered = BytesIO()
+        screenshot.save(buffered, format="PNG")
+        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+    def record_anchor(self, position: Tuple[int, int]):
+        """Запись характерного участка формы, по которому находятся все поля"""
+        w, h = 200, 60
+        anchor = FormField(
+            name=f"{FieldType.ANCHOR} {len(self.anchors) + 1}",
+            field_type=FieldType.ANCHOR,
+            screen_position=(position[0] - w // 2, position[1] - h // 2),
+            size=(w, h),
+            image_data=self.capture_image(position, w, h),
+            click_offset=(0, 0)
+        )
+        self.anchors.append(anchor)
+        logging.info(f"Записан якорь на позиции {position}")
+
+    def record_result_panel(self, position: Tuple[int, int]):
+        """Запись участка, который появляется, когда приложение обработало строку"""
+        w, h = 200, 60
+        self.result_panel = FormField(
+            name=FieldType.RESULT_PANEL,
+            field_type=FieldType.RESULT_PANEL,
+            screen_position=(position[0] - w // 2, position[1] - h // 2),
+            size=(w, h),
+            image_data=self.capture_image(position, w, h),
+            click_offset=(0, 0)
+        )
+        logging.info(f"Записана панель результата на позиции {position}")
+
+    def record_tab_skip(self):
+        """Остановка Tab между полями, которую нужно проскочить (кнопка, флажок и т.п.)"""
+        self.tab_order.append(None)
+        logging.info("Записана пропускаемая остановка Tab")
+
+    def form_region(self) -> Tuple[int, int, int, int]:
+        """Общая область всех полей формы"""
+        regions = [field.current_region() for field in self.fields]
+        return (min(r[0] for r in regions), min(r[1] for r in regions),
+                max(r[2] for r in regions), max(r[3] for r in regions))
+
+    def bind_to_anchors(self):
+        """Смещения полей и дополнительных якорей относительно первого якоря"""
+        if not self.anchors:
+            return
+
+        base_x, base_y = self.anchors[0].screen_position
+        for item in self.anchors + self.fields:
+            x, y = item.screen_position
+            item.anchor_offset = (x - base_x, y - base_y)
 
     def record_field(self, field_type: str, position: Tuple[int, int]):
         image_data = None
         if hasattr(self, 'use_image') and self.use_image:
-            x, y = position
-            w, h = 200, 60
-            screenshot = pyautogui.screenshot(region=(x - w // 2, y - h // 2, w, h))
-            buffered = BytesIO()
-            screenshot.save(buffered, format="PNG")
-            image_data = base64.b64encode(buffered.getvalue()).decode('utf-8')
+            image_data = self.capture_image(position)
 
         field = FormField(
             name=field_type,
@@ -263,25 +1309,71 @@ class FormManager:
             click_offset=(0, 0)
         )
         self.fields.append(field)
+        self.tab_order.append(field.name)
         logging.info(f"Записано поле: {field_type} на позиции {position}")
 
     def save_fields(self, filename: str):
         data = {
             'fields': [field.to_dict() for field in self.fields],
+            'anchors': [anchor.to_dict() for anchor in self.anchors],
+            'result_panel': self.result_panel.to_dict() if self.result_panel else None,
+            'tab_order': self.tab_order,
             'timestamp': datetime.now().isoformat()
         }
 
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
 
+        self.fields_file = filename
         logging.info(f"Поля сохранены в {filename}")
 
+    @staticmethod
+    def timings_path(filename: str) -> Path:
+        """Файл замеров задержек рядом с шаблоном формы"""
+        return Path(filename).with_suffix('.timings.json')
+
+    def save_timings(self):
+        if not self.fields_file:
+            return
+        data = {field.name: field.timings.to_dict() for field in self.fields}
+        try:
+            with open(self.timings_path(self.fields_file), 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            logging.warning(f"Не удалось сохранить замеры задержек: {e}")
+
+    def load_timings(self):
+        path = self.timings_path(self.fields_file)
+        if not path.exists():
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for field in self.fields:
+                if field.name in data:
+                    field.timings = StepTimings.from_dict(data[field.name])
+        except Exception as e:
+            logging.warning(f"Не удалось загрузить замеры задержек: {e}")
+
     def load_fields(self, filename: str) -> bool:
         try:
             with open(filename, 'r', encoding='utf-8') as f:
                 data = json.load(f)
 
+            for field in self.fields + self.anchors:
+                field.reset_template()
             self.fields = [FormField.from_dict(field_data) for field_data in data['fields']]
+            self.anchors = [FormField.from_dict(anchor_data) for anchor_data in data.get('anchors', [])]
+            self.result_panel = FormField.from_dict(data['result_panel']) if data.get('result_panel') else None
+            self.tab_order = data.get('tab_order') or [field.name for field in self.fields]
+
+            # Шаблоны декодируются сразу, а не при каждом поиске поля
+            for field in self.fields + self.anchors:
+                field.get_template()
+
+            self.fields_file = filename
+            self.load_timings()
+
             logging.info(f"Загружено {len(self.fields)} полей из {filename}")
             return True
         except Exception as e:
@@ -290,19 +1382,270 @@ class FormManager:
 
 
 # ================== ОБРАБОТЧИК EXCEL ==================
+class WorkbookCache:
+    """Разобранные таблицы в .npz, адресуемые хешем содержимого исходного файла.
+    Индекс по (путь, размер, mtime) позволяет не читать файл повторно, пока он не изменился.
+    variant - всё, от чего ещё зависит разобранная таблица (например, разбираемые столбцы дат)"""
+    VERSION = 3  # Менять при изменении нормализации таблицы - старые записи станут недействительны
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir: str, variant: str = ""):
+        self.cache_dir = Path(cache_dir)
+        self.index_path = self.cache_dir / self.INDEX_FILE
+        self.variant = variant
+
+    def stat_key(self, filepath: str) -> str:
+        stat = os.stat(filepath)
+        return f"{os.path.abspath(filepath)}|{stat.st_size}|{stat.st_mtime_ns}|{self.variant}"
+
+    def content_hash(self, filepath: str) -> str:
+        digest = hashlib.blake2b(f"v{self.VERSION}|{self.variant}".encode(), digest_size=20)
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def data_path(self, content_hash: str) -> Path:
+        return self.cache_dir / f"{content_hash}.npz"
+
+    def load_index(self) -> Dict[str, dict]:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_index(self, index: Dict[str, dict]):
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, ensure_ascii=False)
+
+    def get(self, filepath: str) -> Optional[pd.DataFrame]:
+        try:
+            key = self.stat_key(filepath)
+            index = self.load_index()
+            entry = index.get(key)
+            # Запись прежней версии нормализации - промах, таблица будет разобрана заново
+            if (entry is not None and entry.get('version') == self.VERSION
+                    and self.data_path(entry['hash']).exists()):
+                return self.read(self.data_path(entry['hash']))
+
+            # Размер или время изменились - файл мог остаться тем же (копирование, touch)
+            content_hash = self.content_hash(filepath)
+            if self.data_path(content_hash).exists():
+                self.remember(index, key, filepath, content_hash)
+                return self.read(self.data_path(content_hash))
+        except Exception as e:
+            logging.warning(f"Кэш таблицы недоступен: {e}")
+        return None
+
+    def put(self, filepath: str, df: pd.DataFrame):
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            content_hash = self.content_hash(filepath)
+            self.write(self.data_path(content_hash), df)
+            self.remember(self.load_index(), self.stat_key(filepath), filepath, content_hash)
+        except Exception as e:
+            logging.warning(f"Не удалось сохранить таблицу в кэш: {e}")
+
+    def remember(self, index: Dict[str, dict], key: str, filepath: str, content_hash: str):
+        """Записать версию файла в индекс, вытеснив прежние версии того же файла с тем же вариантом разбора"""
+        path = os.path.abspath(filepath)
+
+        def same_file(entry: dict) -> bool:
+            return entry['path'] == path and entry.get('variant', '') == self.variant
+
+        stale = {entry['hash'] for old_key, entry in index.items() if same_file(entry) and old_key != key}
+        index = {old_key: entry for old_key, entry in index.items() if not same_file(entry)}
+        index[key] = {'path': path, 'hash': content_hash, 'version': self.VERSION, 'variant': self.variant}
+        in_use = {entry['hash'] for entry in index.values()}
+        for old_hash in stale - in_use:
+            self.data_path(old_hash).unlink(missing_ok=True)
+        self.save_index(index)
+
+    @staticmethod
+    def write(path: Path, df: pd.DataFrame):
+        arrays = {}
+        for position, column in enumerate(df.columns):
+            values = df[column].to_numpy()
+            arrays[f"c{position}"] = values if values.dtype == bool else values.astype(str)
+        arrays['columns'] = np.array(json.dumps([str(column) if not isinstance(column, int) else column
+                                                 for column in df.columns], ensure_ascii=False))
+        # Сначала во временный файл: прерванная запись не оставит битый кэш
+        tmp_path = path.with_name(path.stem + '.tmp.npz')
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read(path: Path) -> pd.DataFrame:
+        with np.load(path, allow_pickle=False) as data:
+            columns = json.loads(str(data['columns']))
+            return pd.DataFrame({
+                column: (data[f"c{position}"] if data[f"c{position}"].dtype == bool
+                         else data[f"c{position}"].astype(object))
+                for position, column in enumerate(columns)
+            })
+
+
 class ExcelProcessor:
+    DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%Y.%m.%d']
+    DATE_PARTS = [FieldType.BIRTH_DAY, FieldType.BIRTH_MONTH, FieldType.BIRTH_YEAR]
+    BAD_DATE = "Ошибка даты"  # Столбец-маска строк с неразобранной датой
+
     @staticmethod
-    def load_excel(filepath: str) -> Optional[pd.DataFrame]:
+    def load_excel(filepath: str, date_columns: Sequence[int] = ()) -> Optional[pd.DataFrame]:
         try:
             df = pd.read_excel(filepath, header=None, dtype=str, engine='openpyxl')
             df = df.fillna('')
-            df = df.applymap(lambda x: str(x).strip() if pd.notna(x) else '')
+            df = df.apply(lambda column: column.astype(str).str.strip())
+            ExcelProcessor.add_date_parts(df, date_columns)
             logging.info(f"Загружен Excel файл: {filepath}, строк: {len(df)}")
             return df
         except Exception as e:
             logging.error(f"Ошибка загрузки Excel: {e}")
             return None
 
+    @staticmethod
+    def load_cached(filepath: str, cache_dir: str, date_columns: Sequence[int] = ()) -> Optional[pd.DataFrame]:
+        """load_excel через кэш разобранных таблиц; без каталога кэша - обычная загрузка"""
+        if not cache_dir:
+            return ExcelProcessor.load_excel(filepath, date_columns)
+        cache = WorkbookCache(cache_dir, json.dumps(sorted(date_columns)))
+        df = cache.get(filepath)
+        if df is not None:
+            logging.info(f"Таблица {filepath} загружена из кэша, строк: {len(df)}")
+            return df
+        df = ExcelProcessor.load_excel(filepath, date_columns)
+        if df is not None:
+            cache.put(filepath, df)
+        return df
+
+    @staticmethod
+    def split_dates(values: pd.Series) -> pd.DataFrame:
+        """Разобрать столбец дат целиком: день, месяц, год строками и маска неразобранных"""
+        text = values.fillna('').astype(str).str.strip().str.split(' ', n=1).str[0]
+        day, month, year = ExcelProcessor.DATE_PARTS
+        result = pd.DataFrame({part: pd.Series('', index=values.index, dtype=object)
+                               for part in ExcelProcessor.DATE_PARTS})
+        pending = text != ''
+
+        # Один векторный проход на формат, каждый - только по ещё не разобранным значениям.
+        # Части даты берутся сразу из результата: годы вне диапазона datetime64[ns] в общий столбец не попадают
+        for fmt in ExcelProcessor.DATE_FORMATS:
+            if not pending.any():
+                break
+            try:
+                parsed = pd.to_datetime(text[pending], format=fmt, errors='coerce')
+            except (ValueError, OverflowError):
+                continue
+            parsed = parsed[parsed.notna()]
+            if parsed.empty:
+                continue
+            result.loc[parsed.index, day] = parsed.dt.day.astype(str).str.zfill(2)
+            result.loc[parsed.index, month] = parsed.dt.month.astype(str).str.zfill(2)
+            result.loc[parsed.index, year] = parsed.dt.year.astype(str)
+            pending[parsed.index] = False
+
+        # Остаток - как parse_date, по одному разу на уникальное значение
+        leftovers = text[pending]
+        parts = {}
+        for value in leftovers.unique():
+            try:
+                dt = ExcelProcessor.to_datetime(value)
+                parts[value] = (f"{dt.day:02d}", f"{dt.month:02d}", str(dt.year))
+            except Exception:
+                continue
+        parsed = leftovers[leftovers.isin(parts.keys())]
+        for position, part in enumerate(ExcelProcessor.DATE_PARTS):
+            result.loc[parsed.index, part] = parsed.map({value: item[position] for value, item in parts.items()})
+        pending[parsed.index] = False
+
+        # Как и parse_date: неразобранная дата вводится как есть (без части после пробела)
+        for part in ExcelProcessor.DATE_PARTS:
+            result.loc[pending, part] = text[pending]
+        result[ExcelProcessor.BAD_DATE] = pending
+        return result
+
+    @staticmethod
+    def date_part_columns(position: int) -> List[str]:
+        """Имена столбцов дня, месяца, года и маски ошибок, разобранных из столбца position"""
+        return [f"{part} [{position}]" for part in ExcelProcessor.DATE_PARTS + [ExcelProcessor.BAD_DATE]]
+
+    @staticmethod
+    def add_date_parts(df: pd.DataFrame, date_columns: Sequence[int]):
+        """Добавить к таблице готовые столбцы дня, месяца, года и маску ошибок для каждого столбца дат"""
+        for position in date_columns:
+            if position not in df.columns:
+                continue
+            dates = ExcelProcessor.split_dates(df[position])
+            for column, name in zip(dates.columns, ExcelProcessor.date_part_columns(position)):
+                df[name] = dates[column]
+
+    @staticmethod
+    def bad_date_rows(df: pd.DataFrame, date_columns: Sequence[int]) -> List[int]:
+        """Строки, где не разобрана хотя бы одна из дат"""
+        bad = np.zeros(len(df), dtype=bool)
+        for position in date_columns:
+            mask = ExcelProcessor.date_part_columns(position)[-1]
+            if mask in df.columns:
+                bad |= df[mask].to_numpy(dtype=bool)
+        return np.flatnonzero(bad).tolist()
+
+    @staticmethod
+    def normalize_cell(value) -> str:
+        """Значение ячейки в виде строки, как его даёт read_excel(dtype=str)"""
+        if value is None:
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value).strip()
+
+    @staticmethod
+    def iter_excel(filepath: str, start_row: int = 0) -> Iterator[List[str]]:
+        """Строки активного листа по одной; память не растёт с размером файла"""
+        wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            ws = wb.active
+            empty = []
+            for values in ws.iter_rows(min_row=start_row + 1, values_only=True):
+                row = [ExcelProcessor.normalize_cell(value) for value in values]
+                # Пустые строки в конце листа отбрасываются, как в read_excel
+                if not any(row):
+                    empty.append(row)
+                    continue
+                yield from empty
+                empty = []
+                yield row
+        finally:
+            wb.close()
+
+    @staticmethod
+    def count_rows(filepath: str) -> Optional[int]:
+        """Число строк по размерам листа из заголовка файла, без чтения данных"""
+        try:
+            wb = openpyxl.load_workbook(filepath, read_only=True)
+            try:
+                ws = wb.active
+                if ws.max_row is None:
+                    # Размеры листа в файле не записаны - считаем строки проходом по листу
+                    ws.reset_dimensions()
+                    return sum(1 for _ in ws.iter_rows(values_only=True))
+                return ws.max_row
+            finally:
+                wb.close()
+        except Exception as e:
+            logging.error(f"Ошибка открытия Excel: {e}")
+            return None
+
+    @staticmethod
+    def to_datetime(date_str: str) -> datetime:
+        """Дата по известным форматам, затем через dateutil"""
+        for fmt in ExcelProcessor.DATE_FORMATS:
+            try:
+                return datetime.strptime(date_str, fmt)
+            except ValueError:
+                continue
+        return date_parse(date_str, dayfirst=True)
+
     @staticmethod
     def parse_date(date_str: str) -> Tuple[str, str, str]:
         if not date_str or pd.isna(date_str) or str(date_str).strip() == '':
@@ -313,44 +1656,285 @@ class ExcelProcessor:
             if ' ' in date_str:
                 date_str = date_str.split()[0]
 
-            formats = ['%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%Y.%m.%d']
-            dt = None
-
-            for fmt in formats:
-                try:
-                    dt = datetime.strptime(date_str, fmt)
-                    break
-                except ValueError:
-                    continue
-
-            if dt is None:
-                dt = date_parse(date_str, dayfirst=True)
-
+            dt = ExcelProcessor.to_datetime(date_str)
             return f"{dt.day:02d}", f"{dt.month:02d}", str(dt.year)
         except Exception as e:
             logging.error(f"Ошибка парсинга даты '{date_str}': {e}")
             return date_str, date_str, date_str
 
-    @staticmethod
-    def extract_row_data(row: pd.Series) -> Dict[str, str]:
+
+class ColumnMapping:
+    """Соответствие столбцов таблицы полям формы из настроек.
+    Компилируется один раз в операции над целыми столбцами; для потокового чтения - те же шаги над одной строкой"""
+    TRANSLIT = {
+        'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+        'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+        'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': 'ie', 'ы': 'y',
+        'ь': '', 'э': 'e', 'ю': 'iu', 'я': 'ia',
+    }
+    TRANSLIT_TABLE = str.maketrans({**TRANSLIT, **{k.upper(): v.capitalize() for k, v in TRANSLIT.items()}})
+
+    # Преобразование: (над столбцом pd.Series, над одним значением)
+    TRANSFORMS = {
+        'trim': (lambda column: column.str.strip(), str.strip),
+        'upper': (lambda column: column.str.upper(), str.upper),
+        'lower': (lambda column: column.str.lower(), str.lower),
+        'translit': (lambda column: column.str.translate(ColumnMapping.TRANSLIT_TABLE),
+                     lambda value: value.translate(ColumnMapping.TRANSLIT_TABLE)),
+    }
+    SPLIT = 'date_split'  # Завершающее преобразование: одно значение -> день, месяц, год
+
+    def __init__(self, entries: List[dict]):
+        self.entries = []
+        for entry in entries:
+            transforms = list(entry.get('transforms', []))
+            unknown = [name for name in transforms if name not in self.TRANSFORMS and name != self.SPLIT]
+            if unknown:
+                raise ValueError(f"Неизвестные преобразования столбца {entry.get('column')}: {unknown}")
+            split = bool(transforms) and transforms[-1] == self.SPLIT
+            if self.SPLIT in transforms[:-1]:
+                raise ValueError(f"'{self.SPLIT}' должно быть последним преобразованием")
+            fields = list(entry['fields']) if split else [entry['field']]
+            if split and len(fields) != 3:
+                raise ValueError(f"'{self.SPLIT}' требует трёх полей: день, месяц, год")
+            self.entries.append((entry['column'], [name for name in transforms if name != self.SPLIT], split, fields))
+        self.uses_names = any(isinstance(column, str) for column, *_ in self.entries)
+
+    def positions(self, header: Optional[Sequence[str]]) -> List[Optional[int]]:
+        """Номера столбцов; заголовки ищутся в первой строке таблицы"""
+        names = [str(value) for value in header] if header is not None else []
+        positions = []
+        for column, *_ in self.entries:
+            if isinstance(column, str):
+                positions.append(names.index(column) if column in names else None)
+                if column not in names:
+                    logging.warning(f"Столбец '{column}' не найден в заголовке таблицы")
+            else:
+                positions.append(column)
+        return positions
+
+    def date_columns(self, header: Optional[Sequence[str]]) -> List[int]:
+        """Столбцы, которые можно разобрать как даты заранее, при загрузке таблицы:
+        date_split без преобразований, меняющих значение"""
+        return sorted({position for (column, transforms, split, fields), position
+                       in zip(self.entries, self.positions(header))
+                       if split and position is not None and set(transforms) <= {'trim'}})
+
+    @property
+    def first_row(self) -> int:
+        """Первая строка данных: при заголовках по именам первая строка - заголовок"""
+        return 1 if self.uses_names else 0
+
+    def compile(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Столбцы значений для каждого поля по всей таблице"""
+        header = df.iloc[0].tolist() if self.uses_names and len(df) else None
+        empty = pd.Series('', index=df.index, dtype=object)
+        columns = {}
+        for (column, transforms, split, fields), position in zip(self.entries, self.positions(header)):
+            values = df[position] if position is not None and position in df.columns else empty
+            # Дата уже разобрана при загрузке (и лежит в кэше таблиц)
+            parts = ExcelProcessor.date_part_columns(position) if split and position is not None else []
+            if parts and parts[-1] in df.columns and set(transforms) <= {'trim'}:
+                for field_type, part in zip(fields, parts):
+                    columns[field_type] = df[part].to_numpy()
+                continue
+
+            values = values.astype(str)
+            for name in transforms:
+                values = self.TRANSFORMS[name][0](values)
+            if split:
+                dates = ExcelProcessor.split_dates(values)
+                for field_type, part in zip(fields, ExcelProcessor.DATE_PARTS):
+                    columns[field_type] = dates[part].to_numpy()
+            else:
+                columns[fields[0]] = values.to_numpy()
+        return columns
+
+    def extract(self, row: Sequence[str], positions: List[Optional[int]]) -> Dict[str, str]:
+        """Значения полей одной строки"""
         data = {}
-        row_list = row.tolist()
+        for (column, transforms, split, fields), position in zip(self.entries, positions):
+            value = str(row[position]) if position is not None and position < len(row) else ''
+            for name in transforms:
+                value = self.TRANSFORMS[name][1](value)
+            if split:
+                data.update(zip(fields, ExcelProcessor.parse_date(value)))
+            else:
+                data[fields[0]] = value
+        return data
 
-        data[FieldType.LAST_NAME] = row_list[1] if len(row_list) > 1 else ''
-        data[FieldType.FIRST_NAME] = row_list[2] if len(row_list) > 2 else ''
-        data[FieldType.MIDDLE_NAME] = row_list[3] if len(row_list) > 3 else ''
 
-        if len(row_list) > 4:
-            day, month, year = ExcelProcessor.parse_date(row_list[4])
-            data[FieldType.BIRTH_DAY] = day
-            data[FieldType.BIRTH_MONTH] = month
-            data[FieldType.BIRTH_YEAR] = year
-        else:
-            data[FieldType.BIRTH_DAY] = ''
-            data[FieldType.BIRTH_MONTH] = ''
-            data[FieldType.BIRTH_YEAR] = ''
+class RowPlan:
+    """Значения таблицы, заранее разложенные по записанным полям формы.
+    Строится один раз после загрузки; пустые значения отфильтрованы маской"""
+    __slots__ = ('fields', 'columns', 'present', 'last_names', 'first_names')
 
-        return data
+    def __init__(self, fields: List[FormField], columns: List[np.ndarray],
+                 last_names: np.ndarray, first_names: np.ndarray):
+        self.fields = fields
+        self.columns = columns  # По столбцу на поле, в порядке полей
+        self.present = np.column_stack([column != '' for column in columns]) if columns else None
+        self.last_names = last_names
+        self.first_names = first_names
+
+    @classmethod
+    def compile(cls, df: pd.DataFrame, fields: List[FormField], mapping: ColumnMapping) -> 'RowPlan':
+        by_type = mapping.compile(df)
+        empty = np.full(len(df), '', dtype=object)
+        columns = [by_type.get(field.field_type, empty) for field in fields]
+        return cls(list(fields), columns,
+                   by_type.get(FieldType.LAST_NAME, empty), by_type.get(FieldType.FIRST_NAME, empty))
+
+    def __len__(self) -> int:
+        return len(self.last_names)
+
+    def entries(self, index: int) -> List[Tuple[FormField, str]]:
+        """Непустые значения строки в порядке полей"""
+        if self.present is None:
+            return []
+        return [(self.fields[k], self.columns[k][index]) for k in np.flatnonzero(self.present[index])]
+
+    def label(self, index: int) -> str:
+        return f"{self.last_names[index]} {self.first_names[index]}"
+
+    @staticmethod
+    def row_entries(fields: List[FormField], row: Sequence[str], mapping: ColumnMapping,
+                    positions: List[Optional[int]]) -> Tuple[List[Tuple[FormField, str]], str]:
+        """Значения и подпись одной строки, прочитанной потоком"""
+        data = mapping.extract(row, positions)
+        entries = [(field, data[field.field_type]) for field in fields if data.get(field.field_type)]
+        return entries, f"{data.get(FieldType.LAST_NAME, '')} {data.get(FieldType.FIRST_NAME, '')}"
+
+
+# ================== ИСТОЧНИКИ ДАННЫХ ==================
+class InputSource:
+    """Построчное чтение таблицы: значения нормализованы так же, как при загрузке Excel.
+    Базовый источник - лист Excel; остальные форматы переопределяют чтение и подсчёт строк"""
+    header_in_data = True  # Заголовок (если есть) - первая строка данных
+    always_streamed = False  # Excel можно загрузить целиком (stream_excel выключен)
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def create(path: str, csv_encoding: str = "") -> 'InputSource':
+        extension = Path(path).suffix.lower()
+        if extension == '.csv':
+            return CSVSource(path, ',', csv_encoding)
+        if extension == '.tsv':
+            return CSVSource(path, '\t', csv_encoding)
+        if extension in ('.jsonl', '.ndjson'):
+            return JSONLSource(path)
+        return InputSource(path)
+
+    def rows(self, start_row: int = 0) -> Iterator[List[str]]:
+        return ExcelProcessor.iter_excel(self.path, start_row)
+
+    def header(self) -> List[str]:
+        with closing(self.rows()) as rows:
+            return next(rows, [])
+
+    def count_rows(self) -> Optional[int]:
+        return ExcelProcessor.count_rows(self.path)
+
+
+class CSVSource(InputSource):
+    ENCODINGS = ['utf-8-sig', 'cp1251']  # CSV из Excel - UTF-8 с BOM или в кодировке Windows
+    always_streamed = True
+
+    def __init__(self, path: str, delimiter: str, encoding: str = ""):
+        super().__init__(path)
+        self.delimiter = delimiter
+        self.encodings = [encoding] if encoding else self.ENCODINGS
+        self.encoding = self.encodings[0]  # Уточняется в count_rows, который читает файл целиком
+
+    @staticmethod
+    def records(f) -> Iterator[None]:
+        """Границы записей без разбора полей: запись кончается на переводе строки вне кавычек"""
+        quotes = 0
+        for line in iter(f.readline, ''):
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                quotes = 0
+                yield
+        if quotes:  # Незакрытая кавычка в конце файла - последняя запись
+            yield
+
+    def rows(self, start_row: int = 0) -> Iterator[List[str]]:
+        with open(self.path, 'r', encoding=self.encoding, newline='') as f:
+            for _ in itertools.islice(self.records(f), start_row):
+                pass
+            for record in csv.reader(f, delimiter=self.delimiter):
+                yield [ExcelProcessor.normalize_cell(value) for value in record]
+
+    def count_rows(self) -> Optional[int]:
+        for encoding in self.encodings:
+            try:
+                with open(self.path, 'r', encoding=encoding, newline='') as f:
+                    count = sum(1 for _ in self.records(f))
+            except UnicodeDecodeError as e:
+                logging.warning(f"Файл {self.path} не в кодировке {encoding}: {e}")
+                continue
+            except (OSError, LookupError) as e:
+                logging.error(f"Ошибка открытия файла: {e}")
+                return None
+            self.encoding = encoding
+            return count
+        logging.error(f"Не удалось определить кодировку файла {self.path}")
+        return None
+
+
+class JSONLSource(InputSource):
+    """JSON lines: объект (столбцы - ключи первой записи) или массив значений на строку"""
+    always_streamed = True
+    ENCODING = 'utf-8-sig'
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.keys: Optional[List[str]] = None
+
+    def lines(self, f) -> Iterator[str]:
+        return (line for line in f if line.strip())
+
+    def header(self) -> List[str]:
+        with open(self.path, 'r', encoding=self.ENCODING) as f:
+            first = next(self.lines(f), None)
+        record = json.loads(first) if first is not None else []
+        if isinstance(record, dict):
+            # Ключи объекта - заголовок, а сами объекты - данные с первой строки
+            self.keys = list(record.keys())
+            self.header_in_data = False
+            return self.keys
+        return [ExcelProcessor.normalize_cell(value) for value in self.values(record)]
+
+    @staticmethod
+    def values(record) -> list:
+        return record if isinstance(record, list) else [record]
+
+    def rows(self, start_row: int = 0) -> Iterator[List[str]]:
+        with open(self.path, 'r', encoding=self.ENCODING) as f:
+            lines = self.lines(f)
+            # Пропускаемые строки не разбираются
+            for _ in range(start_row):
+                if next(lines, None) is None:
+                    return
+            for line in lines:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    if self.keys is None:
+                        self.keys = list(record.keys())
+                    values = [record.get(key) for key in self.keys]
+                else:
+                    values = self.values(record)
+                yield [ExcelProcessor.normalize_cell(value) for value in values]
+
+    def count_rows(self) -> Optional[int]:
+        try:
+            with open(self.path, 'r', encoding=self.ENCODING) as f:
+                return sum(1 for _ in self.lines(f))
+        except (OSError, UnicodeDecodeError) as e:
+            logging.error(f"Ошибка открытия файла: {e}")
+            return None
 
 
 # ================== АВТОМАТИЗАТОР ==================
@@ -362,8 +1946,17 @@ class Automator:
         self.current_row = 0
         self.total_rows = 0
         self.df: Optional[pd.DataFrame] = None
+        self.source: Optional[InputSource] = None  # Таблица, читаемая потоком
+        self.plan: Optional[RowPlan] = None
+        self.mapping: Optional[ColumnMapping] = None
+        # Вид формы сразу после ввода последнего поля и область этого поля (для "region_changed")
+        self.row_reference: Optional[Tuple[np.ndarray, Tuple[int, int, int, int]]] = None
+        self.actions: Dict[FormField, FormAction] = {}
         self.message_queue = queue.Queue()
         self.config = Config()
+        self.input_selector = InputMethodSelector()
+        self.input_backend = InputBackend.default
+        self.row_verifier = RowVerifier()
         self.setup_hotkeys()
 
     def setup_hotkeys(self):
@@ -382,51 +1975,189 @@ class Automator:
         self.is_running = False
         self.message_queue.put("Автоматизация остановлена")
 
+    def build_mapping(self) -> bool:
+        """Соответствие столбцов из настроек; нужно и для загрузки, и для запуска"""
+        try:
+            self.mapping = ColumnMapping(self.config.column_mapping)
+            return True
+        except (KeyError, ValueError) as e:
+            self.message_queue.put(f"Ошибка: Некорректное соответствие столбцов: {e}")
+            return False
+
     def load_excel(self, filepath: str) -> bool:
-        self.df = ExcelProcessor.load_excel(filepath)
+        if not self.build_mapping():
+            return False
+        source = InputSource.create(filepath, self.config.csv_encoding)
+        if self.config.stream_excel or source.always_streamed:
+            # Строки будут читаться по ходу заполнения (CSV, TSV и JSONL - всегда)
+            self.df = None
+            rows = source.count_rows()
+            if rows is None:
+                self.source = None
+                return False
+            self.source = source
+            self.total_rows = rows
+            logging.info(f"Файл будет читаться построчно: {filepath}, строк: {rows}")
+            return True
+
+        self.source = None
+        header = source.header() if self.mapping.uses_names else None
+        date_columns = self.mapping.date_columns(header)
+        self.df = ExcelProcessor.load_cached(filepath, self.config.excel_cache_dir, date_columns)
         if self.df is not None:
             self.total_rows = len(self.df)
+            self.report_bad_dates(date_columns)
             return True
         return False
 
+    def report_bad_dates(self, date_columns: Sequence[int]):
+        """Сообщить о строках с неразобранной датой до начала заполнения"""
+        # Строка заголовка (соответствие по именам столбцов) - не дата
+        bad = [i for i in ExcelProcessor.bad_date_rows(self.df, date_columns) if i >= self.mapping.first_row]
+        if not bad:
+            return
+        shown = ', '.join(str(i + 1) for i in bad[:20])
+        more = f" и ещё {len(bad) - 20}" if len(bad) > 20 else ""
+        self.message_queue.put(f"⚠ Не удалось разобрать дату рождения в {len(bad)} строках: {shown}{more}")
+
+    def iter_rows(self, start_row: int) -> Iterator[Tuple[int, List[Tuple[FormField, str]], str]]:
+        """Номер, непустые значения полей и подпись строк, начиная с start_row"""
+        if self.plan is not None:
+            for i in range(max(start_row, self.mapping.first_row), len(self.plan)):
+                yield i, self.plan.entries(i), self.plan.label(i)
+            return
+        fields = self.form_manager.fields
+        header = self.source.header() if self.mapping.uses_names else None
+        if header is not None and self.source.header_in_data:
+            start_row = max(start_row, 1)
+        positions = self.mapping.positions(header)
+        for i, row in enumerate(self.source.rows(start_row), start=start_row):
+            yield (i, *RowPlan.row_entries(fields, row, self.mapping, positions))
+
     def run(self, start_row: int = 0, speed_factor: float = 1.0) -> bool:
         if not self.form_manager.fields:
             self.message_queue.put("Ошибка: Сначала определите поля формы")
             return False
 
-        if self.df is None:
-            self.message_queue.put("Ошибка: Сначала загрузите Excel файл")
+        if self.df is None and self.source is None:
+            self.message_queue.put("Ошибка: Сначала загрузите файл с данными")
             return False
 
         if start_row >= self.total_rows or start_row < 0:
             self.message_queue.put("Ошибка: Некорректный номер стартовой строки")
             return False
 
+        if not self.build_mapping():
+            return False
+
         self.is_running = True
         self.is_paused = False
         self.current_row = start_row
         self.config.speed_factor = speed_factor
+        self.invalidate_values()
+        ImageLocator.configure(self.config)
+        self.input_selector = InputMethodSelector(self.config.input_method)
+        pyautogui.PAUSE = self.config.pyautogui_pause
+        self.input_backend.close()  # Соединение XTest прошлого запуска
+        self.input_backend = InputBackend.create(self.config.input_backend)
+        self.input_backend.implicit_calls = 0
+        self.actions = {}
+        # Значения всех строк раскладываются по полям один раз, до начала заполнения
+        self.plan = (RowPlan.compile(self.df, self.form_manager.fields, self.mapping)
+                     if self.df is not None else None)
 
         thread = threading.Thread(target=self._run_automation, daemon=True)
         thread.start()
         return True
 
+    def wait_for_start(self):
+        """Старт по появлению формы на экране или через фиксированные 5 секунд"""
+        if self.config.pacing_mode == "event":
+            visible = [item for item in self.form_manager.anchors + self.form_manager.fields
+                       if item.get_template() is not None]
+            if visible:
+                self.message_queue.put("Ожидание появления формы на экране...")
+                condition = ReadinessCondition.template_visible(visible[0])
+                if condition.wait(self.config.start_timeout, lambda: self.is_running):
+                    return
+                self.message_queue.put("Форма не обнаружена, запуск по таймауту")
+                return
+
+        self.message_queue.put("Автоматизация начинается через 5 секунд...")
+        time.sleep(5)
+
+    def row_done_condition(self) -> Optional[ReadinessCondition]:
+        """Условие завершения строки из настроек; None - условие недоступно"""
+        name = self.config.row_done_condition
+        fields = self.form_manager.fields
+
+        if name == "result_panel" and self.form_manager.result_panel is not None:
+            return ReadinessCondition.template_visible(self.form_manager.result_panel)
+        if name == "field_cleared" and fields and fields[0].blank_sample is not None:
+            return ReadinessCondition.field_cleared(fields[0])
+        if name == "region_changed" and fields:
+            region = self.form_manager.form_region()
+            if self.row_reference is not None:
+                reference, focused = self.row_reference
+                return ReadinessCondition.region_changed(region, reference, focused)
+            return ReadinessCondition.region_changed(region)
+        return None
+
+    def tracks_row_reference(self) -> bool:
+        return self.config.pacing_mode == "event" and self.config.row_done_condition == "region_changed"
+
+    def capture_row_reference(self, field: FormField):
+        """Запомнить вид формы сразу после ввода в поле: реакция приложения сравнивается с ним"""
+        try:
+            region = self.form_manager.form_region()
+            self.row_reference = (ReadinessCondition.grab_gray(region), field.last_region or field.current_region())
+        except Exception as e:
+            logging.debug(f"Не удалось снять вид формы: {e}")
+            self.row_reference = None
+
+    def wait_row_done(self):
+        """Переход к следующей строке по условию или после фиксированной паузы"""
+        condition = self.row_done_condition() if self.config.pacing_mode == "event" else None
+        self.row_reference = None
+        if condition is None:
+            time.sleep(1.0)
+            return
+
+        if not condition.wait(self.config.row_done_timeout, lambda: self.is_running):
+            logging.warning(f"Условие '{condition.description}' не выполнено за {self.config.row_done_timeout} с")
+
     def _run_automation(self):
         try:
-            self.message_queue.put("Автоматизация начинается через 5 секунд...")
-            time.sleep(5)
+            self.wait_for_start()
 
-            for i in range(self.current_row, self.total_rows):
+            rows = self.iter_rows(self.current_row)
+            current = next(rows, None)
+            while current is not None:
                 if not self.is_running:
                     break
 
                 while self.is_paused and self.is_running:
                     time.sleep(0.1)
 
-                self.process_row(i)
+                self.process_row(*current)
+
+                current = next(rows, None)
+                if current is not None and self.is_running:
+                    self.wait_row_done()
+            rows.close()
+
+            if self.config.learn_timing:
+                self.form_manager.save_timings()
 
-                if i < self.total_rows - 1 and self.is_running:
-                    time.sleep(1.0)
+            if self.input_selector.report():
+                self.message_queue.put(f"⌨ Способы ввода: {self.input_selector.report()}")
+
+            if self.input_backend.implicit_calls:
+                self.message_queue.put(f"⏱ Неявные паузы pyautogui: {self.input_backend.implicit_calls} x "
+                                       f"{pyautogui.PAUSE} с = {self.input_backend.implicit_pause:.1f} с")
+
+            if ImageLocator.use_pyramid and ImageLocator.level_times:
+                self.message_queue.put(f"⏱ Время поиска изображений: {ImageLocator.timing_report()}")
 
             if self.is_running:
                 self.message_queue.put("✅ Автоматизация успешно завершена!")
@@ -438,39 +2169,199 @@ class Automator:
         finally:
             self.is_running = False
 
-    def process_row(self, row_index: int):
-        try:
-            row = self.df.iloc[row_index]
-            data = ExcelProcessor.extract_row_data(row)
+    def invalidate_values(self):
+        for field in self.form_manager.fields:
+            field.last_value = None
+
+    def form_reset_detected(self) -> bool:
+        """Поле с запомненным значением выглядит пустым - форма была сброшена"""
+        for field in self.form_manager.fields:
+            if field.last_value and field.blank_sample is not None:
+                return ReadinessCondition.field_cleared(field).check()
+        return False
+
+    def unchanged(self, field: FormField, value: str) -> bool:
+        return self.config.differential_fill and field.last_value == value
+
+    def fill_row_by_tab(self, values: Dict[FormField, str], locations: Dict[FormField, 'MatchResult'],
+                        verify: bool = True) -> Tuple[List[FormField], List[FormField]]:
+        """Заполнение строки одним потоком нажатий с Tab между полями.
+        Возвращает поля, которые нужно дозаполнить обычным способом, и заполненные поля"""
+        fields_by_name = {field.name: field for field in self.form_manager.fields}
+        order = [name for name in self.form_manager.tab_order if name is None or name in fields_by_name]
+        while order and order[0] is None:
+            order.pop(0)
+        if not order:
+            return self.form_manager.fields, []
+
+        speed_factor = self.config.speed_factor
+        first = fields_by_name[order[0]]
+        action = self.action(first, values.get(first, ''), locations.get(first))
+        click_x, click_y = action.click_position(self.config.use_image_recognition, self.config.search_margin)
+
+        # Мышью только первое поле, дальше фокус переводит Tab (он же выделяет старый текст)
+        pyautogui.moveTo(click_x, click_y, duration=0.3 * speed_factor)
+        pyautogui.click()
+        time.sleep(0.1 * speed_factor)
+        pyautogui.hotkey('ctrl', 'a')
+
+        # Пустое значение означает "проскочить Tab", так же пропускаются неизменившиеся поля
+        sequence = []
+        for name in order:
+            value = values.get(fields_by_name[name], '') if name is not None else ''
+            sequence.append('' if name is not None and self.unchanged(fields_by_name[name], value) else value)
+        while sequence and not sequence[-1]:
+            sequence.pop()
+
+        if all(self.input_selector.choose(value) == InputMethodSelector.TYPE for value in sequence if value):
+            pyautogui.write('\t'.join(sequence), interval=0.02 * speed_factor)
+        else:
+            # Кириллицу и длинные значения вставляем, между ними нажимаем Tab
+            for position, value in enumerate(sequence):
+                if position > 0:
+                    pyautogui.press('tab')
+                if value:
+                    self.input_selector.enter(value, speed_factor)
+        if sequence and self.tracks_row_reference():
+            # Фокус остаётся в поле, куда ввели последнее значение
+            self.capture_row_reference(fields_by_name[order[len(sequence) - 1]])
+        time.sleep(0.25 * speed_factor)
+
+        # Проверка и дозаполнение - в порядке обхода Tab (dict сохраняет порядок и убирает повторы)
+        in_order = list(dict.fromkeys(name for name in order if name is not None))
+        remaining = [field for field in self.form_manager.fields if field.name not in in_order]
+        filled = []
+
+        for name in in_order:
+            field = fields_by_name[name]
+            value = values.get(field, '')
+            if not value or self.unchanged(field, value):
+                continue
+            field.last_region = field.current_region()
+            if verify and not self.action(field, value).verify_field_content(value, field.last_region):
+                logging.warning(f"Поле '{field.name}' не заполнилось через Tab, заполняю отдельно")
+                field.last_value = None
+                remaining.append(field)
+            else:
+                filled.append(field)
+
+        return remaining, filled
+
+    def action(self, field: FormField, value: str, location: Optional['MatchResult'] = None) -> FormAction:
+        """Действие поля создаётся один раз за запуск, для каждой строки меняются только значение и положение"""
+        action = self.actions.get(field)
+        if action is None:
+            action = self.actions[field] = FormAction(field=field, value=value)
+        action.value = value
+        action.location = location
+        return action
+
+    def fill_field(self, field: FormField, value: str, location: Optional['MatchResult'], verify: bool) -> bool:
+        action = self.action(field, value, location)
+        on_typed = (lambda: self.capture_row_reference(field)) if self.tracks_row_reference() else None
+        return action.execute(
+            self.config.speed_factor,
+            use_image=self.config.use_image_recognition,
+            verify=verify,
+            max_attempts=self.config.max_attempts,
+            search_margin=self.config.search_margin,
+            adaptive=self.config.adaptive_timing,
+            learn=self.config.learn_timing,
+            input_selector=self.input_selector,
+            backend=self.input_backend,
+            on_typed=on_typed
+        )
+
+    def verify_row(self, filled: List[Tuple[FormField, str, Optional[str]]],
+                   locations: Dict[FormField, 'MatchResult']) -> Optional[FormField]:
+        """Отложенная проверка строки; несовпавшие поля перезаполняются с проверкой.
+        Возвращает поле, которое так и не удалось заполнить"""
+        mismatched, unknown = self.row_verifier.check(filled)
+        values = {field: value for field, value, _ in filled}
+
+        # Вид поля с таким значением ещё не встречался - один раз проверяем через буфер обмена
+        for field in unknown:
+            value = values[field]
+            if self.action(field, value).verify_field_content(value, RowVerifier.field_region(field)):
+                self.row_verifier.remember(field, value)
+            else:
+                mismatched.append(field)
 
-            self.message_queue.put(
-                f"📝 Обработка строки {row_index + 1}: {data[FieldType.LAST_NAME]} {data[FieldType.FIRST_NAME]}")
+        for field in mismatched:
+            logging.warning(f"Поле '{field.name}' не прошло проверку строки, заполняю повторно")
+            if not self.fill_field(field, values[field], locations.get(field), verify=True):
+                field.last_value = None
+                return field
+            field.last_value = values[field]
+        return None
 
-            for field in self.form_manager.fields:
+    def process_row(self, row_index: int, entries: List[Tuple[FormField, str]], label: str):
+        try:
+            self.current_row = row_index
+
+            self.message_queue.put(f"📝 Обработка строки {row_index + 1}: {label}")
+
+            # Один снимок экрана на строку для поиска всех полей
+            locations = None
+            if self.config.use_image_recognition:
+                if self.form_manager.anchors:
+                    locations = ImageLocator.locate_layout(self.form_manager.anchors, self.form_manager.fields,
+                                                           self.config.search_margin)
+                if locations is None:
+                    locations = ImageLocator.locate_all(self.form_manager.fields, self.config.search_margin)
+            locations = locations or {}
+
+            if self.config.differential_fill and self.form_reset_detected():
+                logging.info("Обнаружен сброс формы, все поля будут заполнены заново")
+                self.invalidate_values()
+
+            # Проверка всей строки одним снимком вместо проверки каждого поля
+            verify_row = self.config.verify_input and self.config.verify_mode == "row"
+            verify_field = self.config.verify_input and not verify_row
+            previous = {field: field.last_value for field in self.form_manager.fields}
+            filled = []
+            if verify_row:
+                self.row_verifier.begin(self.form_manager.fields)
+
+            if self.config.fill_mode == "tab":
+                values = dict(entries)
+                fields, tab_filled = self.fill_row_by_tab(values, locations, verify_field)
+                filled.extend((field, values[field], previous[field]) for field in tab_filled)
+                for field in tab_filled:
+                    field.last_value = values[field]
+                entries = [(field, values[field]) for field in fields if field in values]
+
+            for field, value in entries:
                 if not self.is_running:
                     break
 
-                value = data.get(field.field_type, '')
-
-                if not value:
+                if self.unchanged(field, value):
+                    logging.debug(f"Поле '{field.name}' уже содержит '{value}', пропускаю")
                     continue
 
-                action = FormAction(field=field, value=value)
-                success = action.execute(
-                    self.config.speed_factor,
-                    use_image=self.config.use_image_recognition,
-                    verify=self.config.verify_input,
-                    max_attempts=self.config.max_attempts
-                )
+                success = self.fill_field(field, value, locations.get(field), verify_field)
 
-                if not success:
+                field.last_value = value if success else None
+
+                if success:
+                    filled.append((field, value, previous[field]))
+                else:
                     self.message_queue.put(f"❌ Ошибка заполнения поля {field.name} в строке {row_index + 1}")
                     self.message_queue.put("Остановка автоматизации")
                     self.is_running = False
                     return
 
+            if verify_row and filled and self.is_running:
+                failed = self.verify_row(filled, locations)
+                if failed is not None:
+                    self.message_queue.put(f"❌ Ошибка заполнения поля {failed.name} в строке {row_index + 1}")
+                    self.message_queue.put("Остановка автоматизации")
+                    self.is_running = False
+                    return
+
             self.message_queue.put(f"✅ Строка {row_index + 1} успешно обработана")
-            time.sleep(0.5)
+            if self.config.pacing_mode != "event":
+                time.sleep(0.5)
 
         except Exception as e:
             self.message_queue.put(f"❌ Критическая ошибка в строке {row_index + 1}: {str(e)}")
@@ -487,6 +2378,7 @@ class SimpleGUI:
         self.config = Config.load()
         self.form_manager = FormManager()
         self.automator = Automator(self.form_manager)
+        self.automator.config = self.config
 
         self.excel_path_var = tk.StringVar(value=self.config.excel_file)
         self.start_row_var = tk.IntVar(value=self.config.start_row + 1)
@@ -614,6 +2506,9 @@ class SimpleGUI:
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
     def setup_recording_hotkeys(self):
+        self.anchor_hotkey = '0'
+        self.result_panel_hotkey = '9'
+        self.tab_skip_hotkey = '7'
         self.recording_hotkeys = {
             '1': FieldType.LAST_NAME,
             '2': FieldType.FIRST_NAME,
@@ -626,7 +2521,8 @@ class SimpleGUI:
     def browse_excel(self):
         filename = filedialog.askopenfilename(
             title="Выберите Excel файл",
-            filetypes=[("Excel files", "*.xlsx *.xls"), ("All files", "*.*")]
+            filetypes=[("Excel files", "*.xlsx *.xls"), ("CSV/TSV", "*.csv *.tsv"), ("JSON lines", "*.jsonl *.ndjson"),
+                       ("All files", "*.*")]
         )
         if filename:
             self.excel_path_var.set(filename)
@@ -648,6 +2544,9 @@ class SimpleGUI:
         self.log_message("  2. Наведите курсор на САМУЮ ЛЕВУЮ ВЕРХНЮЮ ТОЧКУ поля 'Фамилия' и нажмите 1")
         self.log_message("  3. Наведите на САМУЮ ЛЕВУЮ ВЕРХНЮЮ ТОЧКУ поля 'Имя' и нажмите 2")
         self.log_message("  4. Повторите для всех полей (3-6)")
+        self.log_message("  5. Наведите на характерную надпись формы (например, 'Фамилия') и нажмите 0 - это якорь")
+        self.log_message("  6. Наведите на панель, появляющуюся после обработки строки, и нажмите 9")
+        self.log_message("  7. Для заполнения через Tab записывайте поля по порядку; 7 - пропустить остановку Tab")
         self.log_message("  8. Нажмите ESC для завершения записи")
 
         self.root.after(100, self.check_recording_keys)
@@ -664,6 +2563,23 @@ class SimpleGUI:
                     self.log_message(f"📝 Записано поле: {field_type} на позиции ({x}, {y})")
                     time.sleep(0.5)
 
+            if keyboard.is_pressed(self.anchor_hotkey):
+                x, y = pyautogui.position()
+                self.form_manager.record_anchor((x, y))
+                self.log_message(f"⚓ Записан якорь формы на позиции ({x}, {y})")
+                time.sleep(0.5)
+
+            if keyboard.is_pressed(self.tab_skip_hotkey):
+                self.form_manager.record_tab_skip()
+                self.log_message("⇥ Записана пропускаемая остановка Tab")
+                time.sleep(0.5)
+
+            if keyboard.is_pressed(self.result_panel_hotkey):
+                x, y = pyautogui.position()
+                self.form_manager.record_result_panel((x, y))
+                self.log_message(f"📋 Записана панель результата на позиции ({x}, {y})")
+                time.sleep(0.5)
+
             if keyboard.is_pressed('esc'):
                 self.form_manager.stop_recording()
                 self.record_btn.config(state=tk.NORMAL)
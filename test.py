@@ -9,9 +9,13 @@ from typing import List, Dict, Tuple, Optional
 import threading
 import queue
 import base64
+import hashlib
+from collections import OrderedDict
 from io import BytesIO
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # Для работы с Excel
+import numpy as np
 import pandas as pd
 import openpyxl
 
@@ -32,6 +36,14 @@ from PIL import Image, ImageGrab
 # Для OCR
 import pytesseract
 
+# Для OCR без запуска tesseract на каждый вызов (необязательно)
+try:
+    import tesserocr
+
+    HAS_TESSEROCR = True
+except ImportError:
+    HAS_TESSEROCR = False
+
 # Для работы с буфером обмена
 try:
     import pyperclip
@@ -58,6 +70,10 @@ class Config:
         self.max_attempts = 5  # Увеличено для надежности
         self.ocr_lang = 'rus'  # Язык для OCR
         self.use_clipboard = True  # Использовать буфер обмена для вставки
+        self.ocr_workers = 2  # Количество постоянно запущенных экземпляров Tesseract
+        self.async_verify = False  # Проверять поле OCR в фоне, пока заполняется следующее
+        self.ocr_cache_size = 1024  # Сколько результатов OCR помнить по отпечатку пикселей
+        self.glyphs_file = "digit_glyphs.npz"  # Образцы цифр шрифта программы для проверки дат без OCR
 
     def save(self, filename: str = "config.json"):
         with open(filename, 'w', encoding='utf-8') as f:
@@ -86,13 +102,23 @@ class FieldType:
 
 class FormField:
     def __init__(self, name: str, field_type: str, screen_position: Tuple[int, int], size: Tuple[int, int] = (300, 50),
-                 image_data: Optional[str] = None, click_offset: Tuple[int, int] = (10, 10)):
+                 image_data: Optional[str] = None, click_offset: Tuple[int, int] = (10, 10),
+                 blank_image: Optional[str] = None):
         self.name = name
         self.field_type = field_type
         self.screen_position = screen_position
         self.size = size
         self.image_data = image_data
         self.click_offset = click_offset
+        self.blank_image = blank_image  # Снимок пустого поля (PNG в base64)
+        self._blank_array = None
+
+    def get_blank_array(self) -> Optional[np.ndarray]:
+        """Эталон пустого поля в оттенках серого (декодируется один раз)"""
+        if self._blank_array is None and self.blank_image:
+            img = Image.open(BytesIO(base64.b64decode(self.blank_image))).convert('L')
+            self._blank_array = np.asarray(img, dtype=np.int16)
+        return self._blank_array
 
     def get_click_position(self) -> Tuple[int, int]:
         x, y = self.screen_position
@@ -107,7 +133,8 @@ class FormField:
             'screen_position': self.screen_position,
             'size': self.size,
             'image_data': self.image_data,
-            'click_offset': self.click_offset
+            'click_offset': self.click_offset,
+            'blank_image': self.blank_image
         }
 
     @classmethod
@@ -118,7 +145,8 @@ class FormField:
             screen_position=tuple(data['screen_position']),
             size=tuple(data['size']),
             image_data=data.get('image_data'),
-            click_offset=tuple(data.get('click_offset', (10, 10)))
+            click_offset=tuple(data.get('click_offset', (10, 10))),
+            blank_image=data.get('blank_image')
         )
 
 
@@ -138,7 +166,7 @@ class FormAction:
         """Чтение содержимого поля с помощью OCR"""
         try:
             screenshot = ImageGrab.grab(bbox=region)
-            text = pytesseract.image_to_string(screenshot, lang=lang).strip()
+            text = OCRService.instance().read(screenshot, lang, OCRProfile.for_field(self.field.field_type))
             return text
         except Exception as e:
             logging.warning(f"Ошибка OCR: {e}")
@@ -146,13 +174,60 @@ class FormAction:
 
     def verify_field_content(self, expected_value: str, region: Tuple[int, int, int, int], lang: str = 'rus') -> bool:
         """Проверить содержимое поля с помощью OCR"""
-        actual_value = self.read_field_content(region, lang)
+        profile = OCRProfile.for_field(self.field.field_type)
+        screenshot = None
+        try:
+            screenshot = ImageGrab.grab(bbox=region)
+            actual_value = OCRService.instance().read(screenshot, lang, profile)
+            if actual_value != expected_value and profile.digits_only:
+                # Несовпадение по образцам цифр перепроверяем Tesseract, прежде чем считать ошибкой
+                actual_value = OCRService.instance().read(screenshot, lang, profile, use_glyphs=False)
+        except Exception as e:
+            logging.warning(f"Ошибка OCR: {e}")
+            actual_value = ""
         if actual_value == expected_value:
+            # Подтверждённое изображение цифр пополняет образцы шрифта
+            OCRService.instance().learn(screenshot, expected_value, profile)
             return True
         else:
             logging.debug(f"Проверка не пройдена. Ожидалось: '{expected_value}', получено: '{actual_value}'")
             return False
 
+    # Считаем столбцы с отличиями от эталона: курсор занимает 1-2 столбца, даже одна цифра - больше
+    BLANK_PIXEL_TOLERANCE = 24
+    BLANK_CARET_COLUMNS = 2
+    BLANK_TEXT_COLUMNS = 4
+    BLANK_BORDER = 3  # Рамку фокуса не сравниваем
+
+    def is_field_blank(self, region: Tuple[int, int, int, int]) -> Optional[bool]:
+        """Сравнить поле с эталоном пустого поля. None - сравнение не дало ответа"""
+        blank = self.field.get_blank_array()
+        if blank is None:
+            return None
+        try:
+            current = np.asarray(ImageGrab.grab(bbox=region).convert('L'), dtype=np.int16)
+        except Exception as e:
+            logging.debug(f"Не удалось снять поле для сравнения: {e}")
+            return None
+        if current.shape != blank.shape:
+            return None
+
+        b = self.BLANK_BORDER
+        diff = np.abs(current[b:-b, b:-b] - blank[b:-b, b:-b]) > self.BLANK_PIXEL_TOLERANCE
+        columns = int(diff.any(axis=0).sum())
+        if columns <= self.BLANK_CARET_COLUMNS:
+            return True
+        if columns >= self.BLANK_TEXT_COLUMNS:
+            return False
+        return None
+
+    def field_is_empty(self, region: Tuple[int, int, int, int], ocr_lang: str = 'rus') -> bool:
+        """Пустое ли поле: сначала по эталону, OCR - только если сравнение не дало ответа"""
+        blank = self.is_field_blank(region)
+        if blank is not None:
+            return blank
+        return not self.read_field_content(region, ocr_lang).strip()
+
     def clear_field(self, region: Tuple[int, int, int, int], speed_factor: float = 1.0, ocr_lang: str = 'rus') -> bool:
         """Очистить поле ввода"""
         # Попробовать разные методы очистки
@@ -173,8 +248,7 @@ class FormAction:
                 time.sleep(0.3 * speed_factor)
 
                 # Проверить, очистилось ли
-                content = self.read_field_content(region, ocr_lang)
-                if not content.strip():
+                if self.field_is_empty(region, ocr_lang):
                     return True
             except Exception as e:
                 logging.debug(f"Метод очистки не сработал: {e}")
@@ -189,8 +263,7 @@ class FormAction:
                 pyautogui.press('backspace')
                 time.sleep(0.05)
 
-            content = self.read_field_content(region, ocr_lang)
-            if not content.strip():
+            if self.field_is_empty(region, ocr_lang):
                 return True
         except Exception as e:
             logging.warning(f"Не удалось очистить поле: {e}")
@@ -308,6 +381,358 @@ class FormAction:
         return False
 
 
+# ================== OCR ==================
+class OCRCache:
+    """LRU-кэш результатов OCR по отпечатку пикселей области и языку"""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(image: Image.Image, lang: str, profile: str = 'default') -> Tuple[bytes, str]:
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+        digest.update(f"{image.mode}{image.size}".encode())
+        return digest.digest(), f"{lang}:{profile}"
+
+    def get(self, key: Tuple[bytes, str]) -> Optional[str]:
+        with self.lock:
+            text = self.items.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key: Tuple[bytes, str], text: str):
+        with self.lock:
+            self.items[key] = text
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"попаданий {self.hits}, промахов {self.misses} ({rate:.0%})"
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Порог бинаризации по методу Оцу"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(hist)
+    means = np.cumsum(hist * np.arange(256))
+    total_weight, total_mean = weights[-1], means[-1]
+    background = weights[:-1]
+    foreground = total_weight - background
+    valid = (background > 0) & (foreground > 0)
+    if not valid.any():
+        return 128
+    between = np.zeros_like(background)
+    mean_b = means[:-1][valid] / background[valid]
+    mean_f = (total_mean - means[:-1][valid]) / foreground[valid]
+    between[valid] = background[valid] * foreground[valid] * (mean_b - mean_f) ** 2
+    return int(np.argmax(between))
+
+
+class OCRProfile:
+    """Настройки распознавания для типа поля: допустимые символы, режим сегментации, предобработка"""
+
+    def __init__(self, name: str, whitelist: str = '', psm: Optional[int] = None, upscale: int = 1,
+                 binarize: bool = False, digits_only: bool = False):
+        self.name = name
+        self.whitelist = whitelist
+        self.psm = psm
+        self.upscale = upscale
+        self.binarize = binarize
+        self.digits_only = digits_only  # Можно сверять с образцами цифр без Tesseract
+
+    @staticmethod
+    def for_field(field_type: str) -> 'OCRProfile':
+        return FIELD_OCR_PROFILES.get(field_type, DEFAULT_OCR_PROFILE)
+
+    def prepare(self, image: Image.Image) -> Image.Image:
+        if self.upscale == 1 and not self.binarize:
+            return image
+        image = image.convert('L')
+        if self.upscale > 1:
+            image = image.resize((image.width * self.upscale, image.height * self.upscale), Image.LANCZOS)
+        if self.binarize:
+            threshold = otsu_threshold(np.asarray(image))
+            image = image.point(lambda v: 255 if v > threshold else 0)
+        return image
+
+    def tesseract_config(self) -> str:
+        options = []
+        if self.psm is not None:
+            options.append(f"--psm {self.psm}")
+        if self.whitelist:
+            options.append(f"-c tessedit_char_whitelist={self.whitelist}")
+        return ' '.join(options)
+
+
+DEFAULT_OCR_PROFILE = OCRProfile('default')
+NAME_OCR_PROFILE = OCRProfile(
+    'name',
+    whitelist='АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя-',
+    psm=7,  # Одна строка текста
+    upscale=2
+)
+DIGITS_OCR_PROFILE = OCRProfile('digits', whitelist='0123456789', psm=7, upscale=3, binarize=True, digits_only=True)
+FIELD_OCR_PROFILES = {
+    FieldType.LAST_NAME: NAME_OCR_PROFILE,
+    FieldType.FIRST_NAME: NAME_OCR_PROFILE,
+    FieldType.MIDDLE_NAME: NAME_OCR_PROFILE,
+    FieldType.BIRTH_DAY: DIGITS_OCR_PROFILE,
+    FieldType.BIRTH_MONTH: DIGITS_OCR_PROFILE,
+    FieldType.BIRTH_YEAR: DIGITS_OCR_PROFILE,
+}
+
+
+class DigitGlyphMatcher:
+    """Распознавание цифр сравнением с образцами, снятыми со шрифта самой программы"""
+    GLYPH_SIZE = 16
+    MAX_SAMPLES = 3  # Образцов на цифру
+    MAX_DISTANCE = 0.08  # Средняя доля несовпадающих пикселей, при которой цифра ещё узнаётся
+    LINE_FILL = 0.9  # Строки/столбцы, почти целиком залитые, - рамка поля, а не цифра
+    MERGED_WIDTH = 1.6  # Во сколько раз шире обычного должен быть символ, чтобы считаться слипшимся
+    CARET_WIDTH = 2  # Символ не шире этого без подходящего образца - курсор ввода, а не цифра
+    WIDTH_TOLERANCE = 0.4  # Допустимое отличие ширины символа от ширины образца (доля)
+
+    def __init__(self):
+        self.glyphs: Dict[str, List[np.ndarray]] = {}
+        self.widths: Dict[str, List[Optional[int]]] = {}  # Исходная ширина образцов, px
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def segment(cls, image: Image.Image) -> List[np.ndarray]:
+        """Разбить изображение поля на отдельные символы по пустым столбцам"""
+        gray = np.asarray(image.convert('L'), dtype=np.int16)
+        # Фон - преобладающий цвет; краями сглаженных символов считаем то, что ближе к фону
+        contrast = np.abs(gray - int(np.median(gray)))
+        peak = int(contrast.max())
+        if peak < 32:
+            return []
+        ink = contrast > peak // 2
+        ink[ink.mean(axis=1) >= cls.LINE_FILL, :] = False
+        ink[:, ink.mean(axis=0) >= cls.LINE_FILL] = False
+
+        columns = ink.any(axis=0)
+        spans = []
+        start = None
+        for x, filled in enumerate(np.append(columns, False)):
+            if filled and start is None:
+                start = x
+            elif not filled and start is not None:
+                spans.append((start, x))
+                start = None
+        if not spans:
+            return []
+
+        # Цифры одинаковой ширины: слипшиеся из-за сглаживания делим поровну (курсор в расчёт не берём)
+        widths = [end - begin for begin, end in spans]
+        width = float(np.median([w for w in widths if w > cls.CARET_WIDTH] or widths))
+        glyphs = []
+        for begin, end in spans:
+            parts = max(1, int(round((end - begin) / width))) if end - begin > cls.MERGED_WIDTH * width else 1
+            bounds = np.linspace(begin, end, parts + 1).round().astype(int)
+            for left, right in zip(bounds[:-1], bounds[1:]):
+                glyph = ink[:, left:right]
+                rows = np.flatnonzero(glyph.any(axis=1))
+                if rows.size:
+                    glyphs.append(glyph[rows[0]:rows[-1] + 1])
+        return glyphs
+
+    @classmethod
+    def normalize(cls, glyph: np.ndarray) -> np.ndarray:
+        """Вписать символ в квадрат с сохранением пропорций и привести к общему размеру"""
+        h, w = glyph.shape
+        side = max(h, w)
+        square = np.zeros((side, side), dtype=np.uint8)
+        top, left = (side - h) // 2, (side - w) // 2
+        square[top:top + h, left:left + w] = glyph * 255
+        resized = Image.fromarray(square).resize((cls.GLYPH_SIZE, cls.GLYPH_SIZE), Image.BILINEAR)
+        return np.asarray(resized, dtype=np.float32) / 255.0
+
+    def learn(self, image: Image.Image, text: str):
+        if not text.isdigit():
+            return
+        glyphs = self.segment(image)
+        if len(glyphs) != len(text):
+            return
+        with self.lock:
+            for digit, glyph in zip(text, glyphs):
+                samples = self.glyphs.setdefault(digit, [])
+                if len(samples) < self.MAX_SAMPLES:
+                    samples.append(self.normalize(glyph))
+                    self.widths.setdefault(digit, []).append(glyph.shape[1])
+
+    def match(self, image: Image.Image) -> Optional[str]:
+        """Распознанные цифры или None, если какой-то символ не похож ни на один образец"""
+        if not self.glyphs:
+            return None
+        with self.lock:
+            samples = [(digit, sample, width) for digit, items in self.glyphs.items()
+                       for sample, width in zip(items, self.widths.get(digit, [None] * len(items)))]
+        digits = [digit for digit, _, _ in samples]
+        stack = np.stack([sample for _, sample, _ in samples])
+        # Образцы без известной ширины (старый файл образцов) подходят по ширине любому символу
+        sample_widths = np.array([width if width is not None else np.nan for _, _, width in samples], dtype=float)
+
+        text = []
+        for glyph in self.segment(image):
+            distances = np.abs(stack - self.normalize(glyph)).mean(axis=(1, 2))
+            # После нормализации узкий курсор похож на "1", поэтому ширина сверяется отдельно
+            width_ok = ~(np.abs(sample_widths - glyph.shape[1]) > self.WIDTH_TOLERANCE * sample_widths)
+            distances[~width_ok] = np.inf
+            best = int(np.argmin(distances))
+            if distances[best] > self.MAX_DISTANCE:
+                if glyph.shape[1] <= self.CARET_WIDTH:
+                    continue
+                self.misses += 1
+                return None
+            text.append(digits[best])
+        self.hits += 1
+        return ''.join(text)
+
+    def save(self, filename: str):
+        with self.lock:
+            arrays = {f"{digit}_{i}": sample for digit, items in self.glyphs.items()
+                      for i, sample in enumerate(items)}
+            arrays.update({f"{digit}_{i}_w": np.array(width) for digit, items in self.widths.items()
+                           for i, width in enumerate(items) if width is not None})
+        if arrays:
+            np.savez_compressed(filename, **arrays)
+
+    def load(self, filename: str):
+        if not os.path.exists(filename):
+            return
+        try:
+            with np.load(filename) as data:
+                glyphs: Dict[str, List[np.ndarray]] = {}
+                widths: Dict[str, List[Optional[int]]] = {}
+                for key in sorted(key for key in data.files if not key.endswith('_w')):
+                    digit = key.split('_')[0]
+                    glyphs.setdefault(digit, []).append(data[key])
+                    width_key = f"{key}_w"
+                    widths.setdefault(digit, []).append(int(data[width_key]) if width_key in data.files else None)
+            with self.lock:
+                self.glyphs = glyphs
+                self.widths = widths
+            logging.info(f"Загружены образцы цифр: {''.join(sorted(glyphs))}")
+        except Exception as e:
+            logging.warning(f"Не удалось загрузить образцы цифр из {filename}: {e}")
+
+    def report(self) -> str:
+        known = ''.join(sorted(self.glyphs)) or 'нет'
+        return f"узнано {self.hits}, передано в OCR {self.misses}, известные цифры: {known}"
+
+
+class OCRService:
+    """Пул постоянно запущенных экземпляров Tesseract с результатами через futures"""
+    _instance: Optional['OCRService'] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, workers: int = 2, cache_size: int = 1024):
+        self.workers = max(1, workers)
+        self.cache = OCRCache(cache_size)
+        self.glyphs = DigitGlyphMatcher()
+        self.local = threading.local()
+        self.apis = []
+        self.apis_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocr')
+        if not HAS_TESSEROCR:
+            logging.info("tesserocr не установлен, OCR через pytesseract (процесс tesseract на каждый вызов)")
+
+    @classmethod
+    def instance(cls, workers: Optional[int] = None, cache_size: Optional[int] = None) -> 'OCRService':
+        with cls._instance_lock:
+            if cls._instance is None or (workers is not None and workers != cls._instance.workers):
+                if cls._instance is not None:
+                    cls._instance.shutdown()
+                cls._instance = cls(workers or 2)
+            if cache_size is not None:
+                cls._instance.cache.max_size = cache_size
+            return cls._instance
+
+    @classmethod
+    def close(cls):
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.shutdown()
+                cls._instance = None
+
+    def api(self, lang: str, profile: OCRProfile = DEFAULT_OCR_PROFILE):
+        """Экземпляр Tesseract потока: модель языка и настройки профиля загружаются один раз"""
+        apis = getattr(self.local, 'apis', None)
+        if apis is None:
+            apis = self.local.apis = {}
+        key = (lang, profile.name)
+        if key not in apis:
+            if profile.psm is not None:
+                api = tesserocr.PyTessBaseAPI(lang=lang, psm=profile.psm)
+            else:
+                api = tesserocr.PyTessBaseAPI(lang=lang)
+            if profile.whitelist:
+                api.SetVariable('tessedit_char_whitelist', profile.whitelist)
+            apis[key] = api
+            with self.apis_lock:
+                self.apis.append(api)
+        return apis[key]
+
+    def recognize(self, image: Image.Image, lang: str, profile: OCRProfile = DEFAULT_OCR_PROFILE) -> str:
+        image = profile.prepare(image)
+        if HAS_TESSEROCR:
+            api = self.api(lang, profile)
+            api.SetImage(image)
+            return api.GetUTF8Text().strip()
+        return pytesseract.image_to_string(image, lang=lang, config=profile.tesseract_config()).strip()
+
+    def recognize_cached(self, image: Image.Image, lang: str, profile: OCRProfile, key: Tuple[bytes, str]) -> str:
+        text = self.recognize(image, lang, profile)
+        self.cache.put(key, text)
+        return text
+
+    def submit(self, image: Image.Image, lang: str = 'rus', profile: OCRProfile = DEFAULT_OCR_PROFILE,
+               use_glyphs: bool = True) -> Future:
+        # Одинаковые пиксели (пустое поле, повторяющиеся значения) не распознаются повторно
+        key = OCRCache.key(image, lang, profile.name)
+        text = self.cache.get(key)
+        if text is None and profile.digits_only and use_glyphs:
+            text = self.glyphs.match(image)
+        if text is not None:
+            future = Future()
+            future.set_result(text)
+            return future
+        return self.executor.submit(self.recognize_cached, image, lang, profile, key)
+
+    def submit_batch(self, images: List[Image.Image], lang: str = 'rus',
+                     profile: OCRProfile = DEFAULT_OCR_PROFILE) -> List[Future]:
+        return [self.submit(image, lang, profile) for image in images]
+
+    def read(self, image: Image.Image, lang: str = 'rus', profile: OCRProfile = DEFAULT_OCR_PROFILE,
+             use_glyphs: bool = True) -> str:
+        return self.submit(image, lang, profile, use_glyphs).result()
+
+    def learn(self, image: Optional[Image.Image], text: str, profile: OCRProfile):
+        """Запомнить цифры с изображения, содержимое которого подтверждено"""
+        if image is not None and profile.digits_only:
+            self.glyphs.learn(image, text)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        with self.apis_lock:
+            for api in self.apis:
+                api.End()
+            self.apis = []
+
+
 # ================== МЕНЕДЖЕР ФОРМ ==================
 class FormManager:
     def __init__(self):
@@ -334,13 +759,25 @@ class FormManager:
             buffered = BytesIO()
             screenshot.save(buffered, format="PNG")
             image_data = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        screen_position = (position[0] - 100, position[1] - 15)
+        size = (200, 30)
+        # Поле записывается пустым - запоминаем, как оно выглядит, для быстрой проверки очистки
+        blank_image = None
+        try:
+            blank = pyautogui.screenshot(region=(*screen_position, *size))
+            buffered = BytesIO()
+            blank.save(buffered, format="PNG")
+            blank_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        except Exception as e:
+            logging.warning(f"Не удалось снять эталон пустого поля {field_type}: {e}")
         field = FormField(
             name=field_type,
             field_type=field_type,
-            screen_position=(position[0] - 100, position[1] - 15),
-            size=(200, 30),
+            screen_position=screen_position,
+            size=size,
             image_data=image_data,
-            click_offset=(0, 0)
+            click_offset=(0, 0),
+            blank_image=blank_image
         )
         self.fields.append(field)
         logging.info(f"Записано поле: {field_type} на позиции {position}")
@@ -472,6 +909,7 @@ class Automator:
         self.is_paused = False
         self.current_row = start_row
         self.config.speed_factor = speed_factor
+        OCRService.instance(self.config.ocr_workers, self.config.ocr_cache_size).glyphs.load(self.config.glyphs_file)
         thread = threading.Thread(target=self._run_automation, daemon=True)
         thread.start()
         return True
@@ -488,6 +926,10 @@ class Automator:
                 self.process_row(i)
                 if i < self.total_rows - 1 and self.is_running:
                     time.sleep(1.0)
+            service = OCRService.instance()
+            self.message_queue.put(f"Кэш OCR: {service.cache.report()}")
+            self.message_queue.put(f"Образцы цифр: {service.glyphs.report()}")
+            service.glyphs.save(self.config.glyphs_file)
             if self.is_running:
                 self.message_queue.put("✅ Автоматизация успешно завершена!")
             else:
@@ -504,6 +946,9 @@ class Automator:
             self.message_queue.put(
                 f"📝 Обработка строки {row_index + 1}: {data[FieldType.LAST_NAME]} {data[FieldType.FIRST_NAME]}"
             )
+            # При фоновой проверке OCR поля идёт одновременно с заполнением следующего
+            async_verify = self.config.verify_input and self.config.async_verify
+            pending = []
             for field in self.form_manager.fields:
                 if not self.is_running:
                     break
@@ -514,16 +959,33 @@ class Automator:
                 success = action.execute(
                     self.config.speed_factor,
                     use_image=self.config.use_image_recognition,
-                    verify=self.config.verify_input,
+                    verify=self.config.verify_input and not async_verify,
                     max_attempts=self.config.max_attempts,
                     ocr_lang=self.config.ocr_lang,
                     use_clipboard=self.config.use_clipboard
                 )
+                if success and async_verify:
+                    screenshot = ImageGrab.grab(bbox=action.get_field_region())
+                    profile = OCRProfile.for_field(field.field_type)
+                    future = OCRService.instance().submit(screenshot, self.config.ocr_lang, profile)
+                    pending.append((action, screenshot, profile, future))
                 if not success:
                     self.message_queue.put(f"❌ Ошибка заполнения поля {field.name} в строке {row_index + 1}")
                     self.message_queue.put("Остановка автоматизации")
                     self.is_running = False
                     return
+            for action, screenshot, profile, future in pending:
+                if future.result() == action.value:
+                    OCRService.instance().learn(screenshot, action.value, profile)
+                    continue
+                logging.warning(f"Фоновая проверка не пройдена для поля '{action.field.name}', заполняю повторно")
+                if not action.execute(self.config.speed_factor, use_image=self.config.use_image_recognition,
+                                      verify=True, max_attempts=self.config.max_attempts,
+                                      ocr_lang=self.config.ocr_lang, use_clipboard=self.config.use_clipboard):
+                    self.message_queue.put(f"❌ Ошибка заполнения поля {action.field.name} в строке {row_index + 1}")
+                    self.message_queue.put("Остановка автоматизации")
+                    self.is_running = False
+                    return
             self.message_queue.put(f"✅ Строка {row_index + 1} успешно обработана")
             time.sleep(0.5)
         except Exception as e:
@@ -540,6 +1002,7 @@ class SimpleGUI:
         self.config = Config.load()
         self.form_manager = FormManager()
         self.automator = Automator(self.form_manager)
+        self.automator.config = self.config
         self.excel_path_var = tk.StringVar(value=self.config.excel_file)
         self.start_row_var = tk.IntVar(value=self.config.start_row + 1)
         self.speed_var = tk.DoubleVar(value=self.config.speed_factor)
@@ -817,6 +1280,7 @@ class SimpleGUI:
     def on_closing(self):
         self.config.save()
         self.automator.stop()
+        OCRService.close()
         self.root.destroy()
 
     def run(self):
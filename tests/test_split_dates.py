@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Регрессия: векторный разбор дат совпадает с построчным ExcelProcessor.parse_date"""
+import os
+import sys
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import main
+except Exception as exc:  # без дисплея и GUI-библиотек модуль не импортируется
+    pytest.skip(f"main.py недоступен: {exc}", allow_module_level=True)
+
+ExcelProcessor = main.ExcelProcessor
+
+VALUES = ['15.05.1190', '1990-05-03', '3.4.1985', '07/08/2001 00:00', '1999.12.31',
+          '15-05-1985', '31.02.2000', 'garbage 1', '']
+
+
+def test_split_dates_matches_parse_date():
+    result = ExcelProcessor.split_dates(pd.Series(VALUES))
+    parts = [tuple(row) for row in result[ExcelProcessor.DATE_PARTS].values.tolist()]
+    assert parts == [ExcelProcessor.parse_date(value) for value in VALUES]
+
+
+def test_split_dates_out_of_range_year():
+    result = ExcelProcessor.split_dates(pd.Series(['15.05.1190']))
+    assert result[ExcelProcessor.DATE_PARTS].iloc[0].tolist() == ['15', '05', '1190']
+    assert not result[ExcelProcessor.BAD_DATE].iloc[0]